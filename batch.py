@@ -0,0 +1,150 @@
+# CALCUL DE L'INDICE D'ATTRACTIVITÉ PAR LOTS #
+#
+# Lit un fichier csv d'adresses (colonnes numero, rue, ville) et écrit les notes au fur et à mesure :
+#
+#   python batch.py adresses.csv notes.csv --workers 8
+#   python batch.py adresses.csv notes.csv --workers 8 --bulk   # géocodage par lots de 1000 adresses
+#
+# Si le fichier de sortie existe déjà, le calcul reprend après la dernière ligne écrite.
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from bulk_geocoding import BULK_API, CHUNK_SIZE
+from http_client import HttpClient
+from response_cache import ResponseCache
+from scoring import ScoringEngine, summary
+
+COLUMNS = ['ligne', 'numero', 'rue', 'ville', 'adresse', 'lat', 'lon', 'code_iris',
+           'total', 'visibilite', 'accessibilite', 'population', 'quartier', 'erreur']
+
+
+def completed_rows(path):
+    """
+    Rows already written in the output file
+    :param path: path of the output file
+    :return: a tuple (number of rows without the header, True if the file starts with the header)
+    """
+    if not os.path.exists(path):
+        return 0, False
+    with open(path, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        first = next(reader, None)
+        if first is None:
+            return 0, False
+        header = first == COLUMNS
+        return sum(1 for _ in reader) + (not header), header
+
+
+def read_addresses(path, skip=0):
+    """
+    Streams the addresses of the input file
+    :param path: path of the csv file (columns numero, rue, ville)
+    :param skip: number of rows to skip (already computed)
+    :return: a generator of tuples (row number, numero, rue, ville)
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        for number, row in enumerate(csv.DictReader(file)):
+            if number >= skip:
+                yield number, row['numero'], row['rue'], row['ville']
+
+
+def with_locations(engine, addresses, chunk_size=CHUNK_SIZE, url=BULK_API):
+    """
+    Geocodes the addresses by chunks as they are read (ScoringEngine.geocode_many)
+    :param addresses: iterable of tuples (row number, numero, rue, ville)
+    :return: a generator of tuples (row number, numero, rue, ville, location), location is False if unknown
+    """
+    addresses = iter(addresses)
+    while True:
+        chunk = list(islice(addresses, chunk_size))
+        if not chunk:
+            return
+        locations = engine.geocode_many([address[1:] for address in chunk], chunk_size=chunk_size, url=url)
+        for address, location in zip(chunk, locations):
+            yield (*address, location or False)
+
+
+def score_row(engine, number, numb, street, city, location=None):
+    """
+    Scores one address, errors are reported in the row instead of stopping the batch
+    :param location: location already geocoded, False if the bulk geocoding did not find the address
+    :return: a dict with the COLUMNS keys
+    """
+    row = {'ligne': number, 'numero': numb, 'rue': street, 'ville': city}
+    if location is False:
+        row['erreur'] = 'adresse inconnue'
+        return row
+    try:
+        location, score = engine.score_address(numb, street, city, location)
+        if location is None:
+            row['erreur'] = 'adresse inconnue'
+            return row
+        row.update(adresse=location['label'], lat=location['lat'], lon=location['lon'],
+                   code_iris=location['code_iris'])
+        for column, note in zip(COLUMNS[8:13], summary(score)):
+            row[column] = note
+    except Exception as error:
+        row['erreur'] = f'{type(error).__name__}: {error}'
+    return row
+
+
+def run(source, target, workers=4, engine=None, bulk=False, chunk_size=CHUNK_SIZE, url=BULK_API):
+    """
+    Scores every address of source and appends the results to target, in the input order.
+    At most 2 * workers addresses are in progress at the same time: memory does not grow with the file.
+    :param source: path of the input csv file
+    :param target: path of the output csv file
+    :param workers: number of addresses scored concurrently
+    :param engine: a ScoringEngine (a new one by default)
+    :param bulk: geocodes the addresses by chunks of chunk_size through the csv service of the API Adresse
+    :param url: url of the csv service (a local stand-in server for the tests)
+    :return: the number of rows written
+    """
+    engine = engine or ScoringEngine()
+    skip, header = completed_rows(target)
+    written = 0
+    with open(target, 'a', newline='', encoding='utf-8') as file, ThreadPoolExecutor(workers) as pool:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        if not header and skip == 0:        # fichier vide ou absent
+            writer.writeheader()
+        pending = []
+        addresses = read_addresses(source, skip)
+        if bulk:
+            addresses = with_locations(engine, addresses, chunk_size, url)
+        for address in addresses:
+            pending.append(pool.submit(score_row, engine, *address))
+            if len(pending) >= 2 * workers:
+                writer.writerow(pending.pop(0).result())
+                file.flush()
+                written += 1
+        for future in pending:
+            writer.writerow(future.result())
+            file.flush()
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcul de l'indice d'attractivité d'un fichier d'adresses")
+    parser.add_argument('source', help='fichier csv des adresses (colonnes numero, rue, ville)')
+    parser.add_argument('target', help='fichier csv des résultats (complété si il existe déjà)')
+    parser.add_argument('--workers', type=int, default=4, help="nombre d'adresses calculées en parallèle")
+    parser.add_argument('--bulk', action='store_true', help='géocodage des adresses par lots (service csv)')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='adresses par lot')
+    parser.add_argument('--bulk-url', default=BULK_API, help='url du service de géocodage par lots')
+    parser.add_argument('--no-cache', action='store_true', help='ignore le cache des réponses des API')
+    args = parser.parse_args()
+
+    engine = ScoringEngine(http=HttpClient(cache=None if args.no_cache else ResponseCache()))
+    written = run(args.source, args.target, workers=args.workers, engine=engine,
+                  bulk=args.bulk, chunk_size=args.chunk, url=args.bulk_url)
+    print(f'{written} adresses calculées', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
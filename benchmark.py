@@ -0,0 +1,471 @@
+# BANC D'ESSAI #
+#
+# Mesures reproductibles des chemins critiques, sans réseau : fichiers du dossier Data (ou leur version
+# convertie par datastore.py) et réponses des API enregistrées dans Data/fixtures/api_responses.json,
+# servies par un serveur HTTP local (les requêtes du client HTTP y sont redirigées).
+#   - rues : recherche des noms de rue dans le fichier FLPM de chaque ville
+#   - rayons : commerces, parkings et équipements autour d'emplacements tirés au hasard
+#   - notes : barèmes des 4 sous-indices
+#   - carte : construction et taille de la carte (rayon par défaut et ville entière)
+#   - adresse : calcul complet d'une adresse (géocodage, IRIS, transports, indices)
+# Chaque exécution est ajoutée à benchmarks.jsonl (une ligne JSON avec le commit) pour comparer les versions.
+#
+#   python benchmark.py                         # toutes les mesures
+#   python benchmark.py --only carte --repeat 3
+#   python benchmark.py --compare               # compare les deux dernières exécutions
+#   python benchmark.py --record                # enregistre les réponses réelles des API (réseau)
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import datastore
+from config import CITIES, PARK
+from http_client import HttpClient
+from indices import access_rating, district_rating, population_rating, visibility_rating
+from maps import MAP_RADIUS, carte, shops_around
+from parkings import PARK_COLUMNS
+from scoring import ScoringEngine, indicators, rate_tables, summary
+from street_index import StreetIndex
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(datastore.DATA_DIR, 'fixtures', 'api_responses.json')
+HISTORY = os.path.join(ROOT, 'benchmarks.jsonl')
+
+# adresse mesurée dans chaque ville (ses réponses d'API sont dans les fixtures)
+ADDRESSES = {
+    'Paris': (10, 'RUE DE RIVOLI'),
+    'Bordeaux': (1, 'COURS DE L INTENDANCE'),
+    'Lille': (1, 'RUE NEUVE'),
+}
+# saisies des utilisateurs, fautes comprises
+QUERIES = ['cours intendance', 'rue sainte catherine', 'rue neuve', 'rue nationalle', 'place gambeta',
+           'quai de la douane', 'rue de paris', 'boulevard victor hugo', 'av de la republique', 'rue esquermoise']
+POINTS = 200            # emplacements tirés au hasard par ville
+SEED = 0
+# paramètres qui distinguent les réponses enregistrées d'un même service
+MATCH_PARAMS = {
+    'api-adresse.data.gouv.fr': ['q'],
+    'pyris.datajazz.io': ['lat'],
+    'data.ratp.fr': ['dataset'],
+    'opendata.paris.fr': ['dataset'],
+    'data.bordeaux-metropole.fr': ['typename'],
+    'opendata.lillemetropole.fr': ['dataset'],
+}
+
+
+# DONNÉES HORS LIGNE #
+
+def offline_load(url, sep=','):
+    """
+    Reads a dataset without network: converted store, else the csv file of the Data folder
+    :return: a dataframe; the national parking file, too big to be bundled, is an empty table if its
+             extracts were not ingested (see parkings.py)
+    """
+    if datastore.version(url) is not None:
+        return datastore.read_dataset(url, sep=sep)
+    local = os.path.join(datastore.DATA_DIR, os.path.basename(url.split('?')[0]))
+    if os.path.exists(local):
+        return datastore.read_dataset(local, sep=sep)
+    if url == PARK:
+        empty = pd.DataFrame({column: pd.Series(dtype=float if column in ('Xlong', 'Ylat') else object)
+                              for column in PARK_COLUMNS})
+        return datastore.read_only(empty)
+    raise FileNotFoundError(f'{datastore.dataset_name(url)} absent du dossier Data')
+
+
+def available(url):
+    try:
+        offline_load(url)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+# SERVEUR LOCAL DES RÉPONSES ENREGISTRÉES #
+
+def load_fixtures(path=FIXTURES):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)['responses']
+
+
+def find_fixture(fixtures, url, params):
+    """
+    Recorded answer of a request: same service and path, the most specific match of the parameters
+    :param url: url without the query
+    :param params: dict of the query parameters
+    :return: the body (json), None if no answer was recorded
+    """
+    found, best = None, -1
+    for fixture in fixtures:
+        if fixture['url'].rstrip('/') != url.rstrip('/'):
+            continue
+        expected = fixture.get('params', {})
+        if all(params.get(name) == str(value) for name, value in expected.items()) and len(expected) > best:
+            found, best = fixture['body'], len(expected)
+    return found
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Answers /<host>/<path>?<query> with the response recorded for https://<host>/<path>,
+    or with the answer computed by server.handlers[host] for the services answered on the fly
+    """
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip('/').partition('/')
+        params = dict(parse_qsl(parts.query))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if host in self.server.handlers:
+            body = self.server.handlers[host](f'/{path}', params)
+        else:
+            body = find_fixture(self.server.fixtures, f'https://{host}/{path}', params)
+        answer = json.dumps(body if body is not None else {}).encode()
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(fixtures, port=0, latency=0.0, handlers=None):
+    """
+    Starts the server of the recorded answers in a background thread
+    :param fixtures: list of recorded answers (see load_fixtures)
+    :param latency: delay added to every answer, in seconds
+    :param handlers: dict {host: function (path, params) -> body or None} answering some services on the fly
+    :return: a tuple (server, base url), server.shutdown() stops it
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+    server.fixtures, server.latency, server.handlers = fixtures, latency, handlers or {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+class StandInAdapter(HTTPAdapter):
+    """
+    Transport adapter sending every request to the local server instead of the real service
+    """
+
+    def __init__(self, base, **kwargs):
+        super().__init__(**kwargs)
+        self.base = base
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = f'{self.base}/{parts.netloc}{parts.path}' + (f'?{parts.query}' if parts.query else '')
+        return super().send(request, **kwargs)
+
+
+def standin_http(base, workers=8, cache=None):
+    """
+    HttpClient whose requests go to the local server (without response cache by default)
+    """
+    session = requests.Session()
+    adapter = StandInAdapter(base, pool_connections=16, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return HttpClient(session=session, workers=workers, cache=cache)
+
+
+# MESURES #
+
+def measure(function, repeat=5, warmup=1):
+    """
+    Duration of a function
+    :param repeat: measured runs
+    :param warmup: runs before the measure (caches, imports)
+    :return: a tuple (dict {runs, min, median, mean, p95} in milliseconds, result of the last run)
+    """
+    result = None
+    for _ in range(warmup):
+        result = function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    return {'runs': repeat, 'min': round(float(times.min()), 3), 'median': round(float(np.median(times)), 3),
+            'mean': round(float(times.mean()), 3), 'p95': round(float(np.percentile(times, 95)), 3)}, result
+
+
+def per_item(stats, count):
+    """
+    Durations of a batch divided by its number of items
+    """
+    return {name: round(value / count, 4) if name != 'runs' else value for name, value in stats.items()}
+
+
+def sample_points(engine, city, count=POINTS, seed=SEED):
+    """
+    Locations around the shops of a city (a shop moved by up to 100m), always the same for a seed
+    :return: two arrays of latitudes and longitudes
+    """
+    shops, _ = engine.banco(city)
+    shops = shops.dropna(subset=['Y', 'X'])
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(shops), count)
+    return (shops['Y'].to_numpy(dtype=float)[rows] + rng.uniform(-0.0009, 0.0009, count),
+            shops['X'].to_numpy(dtype=float)[rows] + rng.uniform(-0.0013, 0.0013, count))
+
+
+def bench_streets(engine, cities, repeat):
+    results = {}
+    for city in cities:
+        if not available(CITIES[city]['flpm']):
+            results[city] = {'skipped': 'FLPM absent du dossier Data'}
+            continue
+        flpm = engine.flpm(city)
+        build, index = measure(lambda: StreetIndex(flpm['Adresse']), repeat=1, warmup=0)
+        stats, matches = measure(lambda: [index.search(query, min_score=80) for query in QUERIES], repeat)
+        results[city] = {'index_ms': build['median'], 'streets': len(index), 'query_ms': per_item(stats, len(QUERIES)),
+                         'matches': sum(len(match) for match in matches)}
+    return results
+
+
+def bench_radius(engine, cities, repeat):
+    results = {}
+    for city in cities:
+        dep = CITIES[city]['dep']
+        lats, lons = sample_points(engine, city)
+        points = list(zip(lats, lons))
+        layers = {'banco': (engine.banco(city)[1], 200), 'parkings': (engine.parking(dep)[1], 400),
+                  'bpe': (engine.bpe(dep)[1], 400)}
+        results[city] = {name: per_item(measure(lambda: [index.query_radius(point, radius) for point in points],
+                                                repeat)[0], len(points))
+                         for name, (index, radius) in layers.items()}
+        results[city]['neighbourhood'] = per_item(
+            measure(lambda: [engine.neighbourhood(city, lat, lon) for lat, lon in points], repeat)[0], len(points))
+    return results
+
+
+def bench_ratings(engine, cities, repeat):
+    results = {}
+    empty = {'metro_tram': None, 'bus': None, 'velo_lib': None}
+    insee = engine.insee()
+    for city in cities:
+        dep = CITIES[city]['dep']
+        lats, lons = sample_points(engine, city, count=POINTS // 4)
+        totals = [indicators(dep, empty, engine.neighbourhood(city, lat, lon), insee.iloc[0])
+                  for lat, lon in zip(lats, lons)]
+        tables = rate_tables(dep, totals[0])
+        raters = {'visibility_rating': (lambda table: visibility_rating(table, dep), 'final_viz'),
+                  'access_rating': (access_rating, 'final_access'),
+                  'population_rating': (population_rating, 'final_pop'),
+                  'district_rating': (district_rating, 'final_dist')}
+        results[city] = {name: measure(lambda: rater(tables[table].iloc[:-1].copy()), repeat * 20)[0]['median']
+                         for name, (rater, table) in raters.items()}
+        results[city]['rate_tables'] = per_item(measure(lambda: [rate_tables(dep, total) for total in totals],
+                                                        repeat)[0], len(totals))
+    return results
+
+
+def bench_maps(engine, cities, repeat):
+    from folium import Figure
+
+    results = {}
+    for city in cities:
+        shops, index = engine.banco(city)
+        numb, street = ADDRESSES[city]
+        location = engine.geocode(numb, street, city)
+        coord = (location['lat'], location['lon'])
+        for name, radius in [(f'{MAP_RADIUS}m', MAP_RADIUS), ('ville', None)]:
+            def build():
+                return Figure().add_child(carte(shops_around(shops, index, coord, radius), coord,
+                                                radius=radius)).render()
+            stats, html = measure(build, max(1, repeat // 2))
+            results.setdefault(city, {})[name] = {'ms': stats, 'html_bytes': len(html)}
+    return results
+
+
+def bench_address(engine, cities, repeat):
+    results = {}
+    for city in cities:
+        numb, street = ADDRESSES[city]
+        cold = ScoringEngine(load=offline_load, http=engine.http)      # données à charger
+        start = time.perf_counter()
+        cold.score_address(numb, street, city)
+        stats, (location, score) = measure(lambda: engine.score_address(numb, street, city), repeat)
+        results[city] = {'cold_ms': round((time.perf_counter() - start) * 1000, 3), 'warm_ms': stats,
+                         'notes': summary(score), 'code_iris': location['code_iris']}
+    return results
+
+
+BENCHMARKS = {
+    'rues': bench_streets,
+    'rayons': bench_radius,
+    'notes': bench_ratings,
+    'carte': bench_maps,
+    'adresse': bench_address,
+}
+
+
+# HISTORIQUE #
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """
+    Description of the run, to compare only what is comparable
+    """
+    return {'commit': git('rev-parse', '--short', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '-uno')),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'store': {name: datastore.version(name) is not None for name in ['adresses', 'iris']}}
+
+
+def read_history(path=HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def flatten(results, prefix=''):
+    """
+    Durations of a run as a flat dict {'carte.Paris.1000m.ms.median': value}
+    """
+    values = {}
+    for name, value in results.items():
+        key = f'{prefix}{name}'
+        if isinstance(value, dict):
+            values.update(flatten(value, key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and name != 'runs':
+            values[key] = value
+    return values
+
+
+def compare(before, after, threshold=0.1):
+    """
+    Prints the medians, durations and sizes of two runs which changed by more than threshold,
+    and the notes of the addresses which changed
+    :return: the number of slower durations
+    """
+    old, new = flatten(before['results']), flatten(after['results'])
+    print(f"{before['env']['commit']} -> {after['env']['commit']}")
+    slower = 0
+    for key in sorted(set(old) & set(new)):
+        if not key.endswith(('.median', '_ms', '_bytes')) or old[key] == 0:
+            continue
+        ratio = new[key] / old[key]
+        if abs(ratio - 1) <= threshold:
+            continue
+        timed = not key.endswith('_bytes')
+        slower += timed and ratio > 1
+        print(f"{key:<50}{old[key]:>12g}{new[key]:>12g}  x{ratio:.2f}{'  plus lent' if timed and ratio > 1 else ''}")
+    for city, result in after['results'].get('adresse', {}).items():
+        previous = before['results'].get('adresse', {}).get(city, {})
+        if 'notes' in previous and previous['notes'] != result.get('notes'):
+            print(f"notes de {city} modifiées : {previous['notes']} -> {result.get('notes')}")
+    return slower
+
+
+# ENREGISTREMENT DES RÉPONSES #
+
+class RecordingSession(requests.Session):
+    """
+    Session keeping the answers of the services of MATCH_PARAMS
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.recorded = []
+
+    def get(self, url, params=None, **kwargs):
+        response = super().get(url, params=params, **kwargs)
+        parts = urlsplit(response.request.url)
+        query = dict(parse_qsl(parts.query))
+        if parts.hostname in MATCH_PARAMS and response.status_code == 200:
+            self.recorded.append({'url': f'https://{parts.hostname}{parts.path}',
+                                  'params': {name: query[name] for name in MATCH_PARAMS[parts.hostname]
+                                             if name in query},
+                                  'body': response.json()})
+        return response
+
+
+def record(path=FIXTURES):
+    """
+    Calls the real services for the addresses of ADDRESSES and saves their answers as fixtures
+    """
+    session = RecordingSession()
+    engine = ScoringEngine(load=offline_load, http=HttpClient(session=session))
+    for city, (numb, street) in ADDRESSES.items():
+        location = engine.locate(numb, street, city)
+        engine.transports(city, location['lat'], location['lon'])
+    with open(path, encoding='utf-8') as file:
+        fixture = json.load(file)
+    fixture['responses'] = session.recorded
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(fixture, file, ensure_ascii=False, indent=1)
+    return len(session.recorded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai des calculs de l'indice et de la carte")
+    parser.add_argument('--only', choices=list(BENCHMARKS), action='append',
+                        help='mesure à lancer (par défaut toutes)')
+    parser.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    parser.add_argument('--repeat', type=int, default=5, help='nombre de mesures par opération')
+    parser.add_argument('--output', default=HISTORY, help='historique des exécutions (une ligne JSON par exécution)')
+    parser.add_argument('--no-save', action='store_true', help="ne pas ajouter l'exécution à l'historique")
+    parser.add_argument('--compare', action='store_true', help='compare les deux dernières exécutions et quitte')
+    parser.add_argument('--record', action='store_true', help='enregistre les réponses réelles des API et quitte')
+    args = parser.parse_args()
+
+    if args.compare:
+        history = read_history(args.output)
+        if len(history) < 2:
+            parser.error("il faut au moins deux exécutions dans l'historique")
+        raise SystemExit(1 if compare(history[-2], history[-1]) else 0)
+    if args.record:
+        print(f'{record()} réponses enregistrées dans {FIXTURES}')
+        return
+
+    server, base = start_standin(load_fixtures())
+    try:
+        engine = ScoringEngine(load=offline_load, http=standin_http(base))
+        cities = args.city or list(CITIES)
+        results = {}
+        for name in args.only or list(BENCHMARKS):
+            start = time.perf_counter()
+            results[name] = BENCHMARKS[name](engine, cities, args.repeat)
+            print(f'{name:<10}{time.perf_counter() - start:8.1f} s')
+            for city, values in results[name].items():
+                print(f'  {city:<10}{json.dumps(values, ensure_ascii=False)}')
+    finally:
+        server.shutdown()
+
+    run = {'env': environment(), 'repeat': args.repeat, 'results': results}
+    if not args.no_save:
+        with open(args.output, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(run, ensure_ascii=False) + '\n')
+        history = read_history(args.output)
+        if len(history) > 1:
+            compare(history[-2], history[-1])
+
+
+if __name__ == '__main__':
+    main()
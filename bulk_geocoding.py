@@ -0,0 +1,209 @@
+# GÉOCODAGE PAR LOTS #
+#
+# Pour les calculs en masse : les adresses sont envoyées par paquets au service CSV de l'API Adresse
+# (/search/csv/) au lieu d'une requête par adresse. L'envoi et la lecture de la réponse se font au fil de
+# l'eau, les résultats sont rapprochés par identifiant de ligne et seules les lignes en échec sont renvoyées.
+#
+# Un serveur local imitant le service permet de tester sans réseau :
+#   python bulk_geocoding.py --port 8765 --fail-rate 0.1
+
+import argparse
+import csv
+import hashlib
+import io
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BULK_API = 'https://api-adresse.data.gouv.fr/search/csv/'
+CHUNK_SIZE = 1000       # adresses par envoi
+RETRIES = 3             # nouvelles tentatives pour les lignes en échec
+BACKOFF = 0.5           # attente avant la première nouvelle tentative, doublée ensuite
+
+
+def search_query(numb, street, city):
+    """
+    Text searched for an address, as sent to the API Adresse
+    """
+    return ' '.join((str(numb) + ' ' + street + ' ' + city).split())
+
+
+def multipart_body(rows, boundary):
+    """
+    Streams the multipart form expected by the service: the csv of the addresses and the column to geocode
+    :param rows: iterable of tuples (id, text searched)
+    :param boundary: multipart boundary
+    :return: a generator of bytes
+    """
+    yield (f'--{boundary}\r\nContent-Disposition: form-data; name="columns"\r\n\r\nq\r\n'
+           f'--{boundary}\r\nContent-Disposition: form-data; name="data"; filename="adresses.csv"\r\n'
+           f'Content-Type: text/csv\r\n\r\nid,q\r\n').encode()
+    for row_id, query in rows:
+        line = io.StringIO()
+        csv.writer(line).writerow([row_id, query])
+        yield line.getvalue().encode()
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+def parse_result(row):
+    """
+    Location of a row of the answer
+    :return: a tuple (status, location): location is a dict {lat, lon, label} for 'ok' rows
+    """
+    status = row.get('result_status') or ('ok' if row.get('latitude') else 'not-found')
+    if status != 'ok':
+        return status, None
+    return status, {'lat': float(row['latitude']), 'lon': float(row['longitude']), 'label': row['result_label']}
+
+
+def geocode_chunk(http, rows, url=BULK_API):
+    """
+    Sends a chunk of addresses and reads the answer as it arrives
+    :param http: an HttpClient
+    :param rows: list of tuples (id, text searched)
+    :return: a dict {id: (status, location)} for the rows found in the answer
+    """
+    boundary = uuid.uuid4().hex
+    response = http.post(url, data=multipart_body(rows, boundary), stream=True,
+                         headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    try:
+        response.raise_for_status()
+        lines = (line.decode('utf-8-sig') for line in response.iter_lines())
+        return {row['id']: parse_result(row) for row in csv.DictReader(lines)}
+    finally:
+        response.close()
+
+
+def bulk_geocode(http, queries, chunk_size=CHUNK_SIZE, retries=RETRIES, url=BULK_API, backoff=BACKOFF):
+    """
+    Geocodes many addresses through the csv service
+    :param http: an HttpClient
+    :param queries: dict {id: text searched}
+    :param chunk_size: addresses per request
+    :param retries: new attempts for the rows in error (request failed, row missing, status error or skipped)
+    :return: a dict {id: location or None}, None for the unknown addresses and the rows still in error
+    """
+    keys = {str(key): key for key in queries}
+    results = {key: None for key in queries}
+    pending = list(keys)
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        failed = []
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                answers = geocode_chunk(http, [(row_id, queries[keys[row_id]]) for row_id in chunk], url)
+            except requests.RequestException:
+                failed += chunk
+                continue
+            for row_id in chunk:
+                status, location = answers.get(row_id, ('error', None))
+                if status in ('ok', 'not-found'):
+                    results[keys[row_id]] = location
+                else:
+                    failed.append(row_id)
+        pending = failed
+        if not pending:
+            break
+    return results
+
+
+# SERVEUR LOCAL DE TEST #
+
+def fake_location(query):
+    """
+    Deterministic location of a text around Bordeaux, for the stand-in server
+    """
+    digest = hashlib.sha256(query.encode()).digest()
+    return 44.84 + digest[0] / 255 * 0.02, -0.58 + digest[1] / 255 * 0.02
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Imitation of /search/csv/: geocodes the column q of the csv with server.resolve, server.fail_rate of the
+    rows are answered in error
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])) if 'Content-Length' in self.headers \
+            else self.read_chunked()
+        form = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+        data = next(part.get_payload(decode=True) for part in form.iter_parts()
+                     if part.get_param('name', header='content-disposition') == 'data')
+
+        output = io.StringIO()
+        reader = csv.DictReader(io.StringIO(data.decode('utf-8')))
+        columns = reader.fieldnames + ['latitude', 'longitude', 'result_label', 'result_status']
+        writer = csv.DictWriter(output, fieldnames=columns)
+        writer.writeheader()
+        for row in reader:
+            if random.random() < self.server.fail_rate:
+                row['result_status'] = 'error'
+            else:
+                location = self.server.resolve(row['q'])
+                if location is None:
+                    row['result_status'] = 'not-found'
+                else:
+                    row.update(latitude=location[0], longitude=location[1], result_label=row['q'],
+                               result_status='ok')
+            writer.writerow(row)
+
+        answer = output.getvalue().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def read_chunked(self):
+        body = b''
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return body
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(port=0, resolve=fake_location, fail_rate=0.0):
+    """
+    Starts the stand-in server in a background thread
+    :param port: port to listen to (0: any free port)
+    :param resolve: function text -> (lat, lon) or None
+    :param fail_rate: share of the rows answered with the status error
+    :return: a tuple (server, url of the csv service), server.shutdown() stops it
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    server.resolve, server.fail_rate = resolve, fail_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/search/csv/'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local imitant le géocodage par lots de l'API Adresse")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='part des lignes renvoyées en erreur')
+    args = parser.parse_args()
+
+    server, url = start_standin(args.port, fail_rate=args.fail_rate)
+    print(f'service de géocodage par lots : {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
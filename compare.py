@@ -0,0 +1,182 @@
+# COMPARAISON D'ADRESSES #
+#
+# Indice d'attractivité de plusieurs locaux d'une même ville, classés du meilleur au moins bon.
+# Le travail commun n'est fait qu'une fois pour tout le lot : les données de la ville sont chargées avant
+# de lancer les calculs, chaque emplacement distinct n'est calculé qu'une fois (plusieurs locaux d'un même
+# immeuble ont les mêmes coordonnées) et chaque ligne INSEE n'est lue qu'une fois par IRIS.
+# Le géocodage, les codes IRIS et les notes des emplacements sont calculés en parallèle.
+#
+#   python compare.py Bordeaux "1 cours de l'intendance" "12 rue sainte catherine" "40 cours victor hugo"
+#   python compare.py Lille --file adresses.txt --workers 8 --grille
+
+import argparse
+import contextvars
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import metrics
+from batch import COLUMNS
+from config import CITIES
+from grid import load_grid
+from http_client import HttpClient
+from response_cache import ResponseCache
+from scoring import ScoringEngine, rate, summary
+
+NOTES = COLUMNS[8:13]       # total, visibilite, accessibilite, population, quartier
+ADDRESS = re.compile(r'^\s*(\d+)\s*(?:(?:bis|ter|quater)\b|[a-d]\b)?[\s,]*(\S.*?)\s*$', re.IGNORECASE)
+
+
+def parse_addresses(text):
+    """
+    Addresses typed one per line, the number first ("12 rue sainte catherine")
+    :param text: a string
+    :return: a list of tuples (numero, rue), numero is '' when the line does not start with a number
+    """
+    addresses = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        found = ADDRESS.match(line)
+        addresses.append((found.group(1), found.group(2)) if found else ('', line.strip()))
+    return addresses
+
+
+def point_key(location):
+    return round(location['lat'], 6), round(location['lon'], 6)
+
+
+def attempt(function):
+    """
+    Function mapped on a pool, in the context of the caller (its spans go to the current trace, see
+    metrics.propagate), returning its exception instead of raising it: an address in error does not stop
+    the comparison
+    """
+    context = contextvars.copy_context()
+
+    def wrapper(*args):
+        try:
+            return context.copy().run(function, *args)     # une copie par appel, les appels étant simultanés
+        except Exception as error:
+            return error
+    return wrapper
+
+
+def error_text(error):
+    return f'{type(error).__name__}: {error}'
+
+
+def score_point(engine, location, insee, grid=None):
+    """
+    Notes of one location
+    :param location: a dict {city, lat, lon, code_iris}
+    :param insee: row of the INSEE data of its IRIS
+    :param grid: optional CityGrid, the notes are read in it when the location is inside
+    :return: a tuple (score, estimation), estimation is True when the notes were read in the grid
+    """
+    city, lat, lon = location['city'], location['lat'], location['lon']
+    transports = engine.transports(city, lat, lon)
+    if grid is not None:
+        score = grid.score(location, insee, transports)
+        if score is not None:
+            return score, True
+    around = engine.neighbourhood(city, lat, lon)
+    with metrics.span('notes'):
+        return rate(CITIES[city]['dep'], transports, around, insee), False
+
+
+def compare(engine, city, addresses, workers=8, grid=None):
+    """
+    Attractiveness index of many addresses of a city, the work shared by the addresses being done once
+    :param engine: a ScoringEngine
+    :param city: name of the city
+    :param addresses: list of tuples (numero, rue)
+    :param workers: number of addresses (then of locations) computed concurrently
+    :param grid: optional CityGrid, estimation of the notes from the cells of the locations
+    :return: a dataframe sorted by rank, columns rang, numero, rue, adresse, lat, lon, code_iris, the notes,
+             estimation and erreur; the addresses in error come last, without rank
+    """
+    rows = [{'numero': numb, 'rue': street} for numb, street in addresses]
+    with ThreadPoolExecutor(workers) as pool:
+        # données de la ville, chargées une fois avant de répartir les calculs
+        # (avec une grille, seules les données INSEE sont nécessaires, le reste au besoin)
+        with metrics.span('chargement comparaison', city=city):
+            if grid is None:
+                for future in engine.warm_up(city, ['indice']).values():
+                    future.result()
+            insee = engine.insee()
+
+        # géocodage des adresses, puis un seul code IRIS par emplacement distinct
+        located = pool.map(attempt(engine.geocode), [row['numero'] for row in rows], [row['rue'] for row in rows],
+                           [city] * len(rows))
+        points = {}
+        for row, location in zip(rows, located):
+            if location is None or isinstance(location, Exception):
+                row['erreur'] = 'adresse inconnue' if location is None else error_text(location)
+                continue
+            row.update(adresse=location['label'], lat=location['lat'], lon=location['lon'])
+            points.setdefault(point_key(location), {'city': city, 'lat': location['lat'], 'lon': location['lon']})
+        codes = pool.map(attempt(engine.code_iris), [point['lat'] for point in points.values()],
+                         [point['lon'] for point in points.values()])
+        for point, code in zip(points.values(), codes):
+            point['code_iris'] = code
+
+        # une seule lecture INSEE par IRIS, puis les notes de chaque emplacement
+        irises = {int(point['code_iris']) for point in points.values() if isinstance(point['code_iris'], str)}
+        rows_insee = {code: insee.loc[code] for code in irises if code in insee.index}
+
+        def score(point):
+            if isinstance(point['code_iris'], Exception):
+                raise point['code_iris']
+            return score_point(engine, point, rows_insee[int(point['code_iris'])], grid)
+
+        scores = dict(zip(points, pool.map(attempt(score), points.values())))
+
+    for row in rows:
+        if 'erreur' in row:
+            continue
+        key = point_key(row)
+        result = scores[key]
+        if isinstance(points[key]['code_iris'], str):
+            row['code_iris'] = points[key]['code_iris']
+        if isinstance(result, Exception):
+            row['erreur'] = error_text(result)
+        else:
+            row.update(zip(NOTES, summary(result[0])), estimation=result[1])
+
+    table = pd.DataFrame(rows, columns=['numero', 'rue', 'adresse', 'lat', 'lon', 'code_iris'] + NOTES +
+                         ['estimation', 'erreur'])
+    table[NOTES] = table[NOTES].astype('Int64')
+    table = table.sort_values('total', ascending=False, na_position='last', kind='stable')
+    table.insert(0, 'rang', table['total'].rank(method='min', ascending=False).astype('Int64'))
+    return table.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparaison de l'indice d'attractivité de plusieurs adresses")
+    parser.add_argument('city', choices=list(CITIES), help='ville des adresses')
+    parser.add_argument('addresses', nargs='*', help='adresses, le numéro en premier')
+    parser.add_argument('--file', help='fichier texte des adresses, une par ligne')
+    parser.add_argument('--workers', type=int, default=8, help='calculs en parallèle')
+    parser.add_argument('--grille', action='store_true', help='notes lues dans la grille précalculée si elle existe')
+    parser.add_argument('--no-cache', action='store_true', help='ignore le cache des réponses des API')
+    args = parser.parse_args()
+
+    text = '\n'.join(args.addresses)
+    if args.file:
+        with open(args.file, encoding='utf-8') as file:
+            text += '\n' + file.read()
+    addresses = parse_addresses(text)
+    if not addresses:
+        parser.error('aucune adresse')
+
+    grid = load_grid(args.city) if args.grille else None
+    engine = ScoringEngine(http=HttpClient(cache=None if args.no_cache else ResponseCache()))
+    table = compare(engine, args.city, addresses, workers=args.workers, grid=grid)
+    table.to_csv(sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# CONFIGURATION DES API ET DES DONNÉES #
+
+import os
+
+
+# API CONFIG #
+
+PYRIS_link = 'https://pyris.datajazz.io/api/coords'
+pappers_key = '0036e5513cdb2eb3135d2d96f81760dc46452322158e1edd'
+pappers_enterprise = 'https://api.pappers.fr/v2/entreprise'
+pappers_reaserch = 'https://api.pappers.fr/v2/recherche'
+PAPPERS_RATE = 5        # requêtes par seconde au plus vers Pappers (quota)
+PAPPERS_TTL = 7 * 24 * 3600     # durée de conservation des fiches Pappers (owners.py)
+
+# 'haversine' pour la rapidité, 'ellipsoid' pour la précision (WGS-84, comme geopy)
+DISTANCE_METHOD = 'haversine'
+
+type_name = 'shoes|garden_center|department_store|cosmetics|leather|perfumery|beauty|cafe|restaurant|bar|interior-decoration|florist|pharmacy|jewelry|bank|hairdresser|convenience|clothes|optician|pastry|bakery|supermarket|alcohol'
+
+
+# DATA #
+
+FLPM_PRS = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/FLPM_PRS.csv'
+FLPM_BDX = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/FLPM_BDX.csv'
+FLPM_LIL = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/FLPM_LIL.csv'
+
+BANCO_PRS = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/BANCO_PRS.csv'
+BANCO_BDX = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/BANCO_BDX.csv'
+BANCO_LIL = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/BANCO_LIL.csv'
+
+METRO_PRS = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/metro_paris.csv'
+FREQ_PRS = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/frequentation_metro_paris.csv'
+FREQ_LIL = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/metro_lil.csv'
+INSEE = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/insee.csv'
+BPE = 'https://raw.githubusercontent.com/MyPopUpStore/PopMyData/main/Data/bpe.csv'
+
+PARK = 'https://static.data.gouv.fr/resources/base-nationale-des-lieux-de-stationnement/20210502-172910/bnls-2-.csv'
+
+
+# CITIES #
+
+# communes : codes INSEE de la ville dans la BAN (Paris : la commune et ses arrondissements)
+CITIES = {
+    'Paris': {'dep': 75, 'flpm': FLPM_PRS, 'banco': BANCO_PRS,
+              'communes': ['75056'] + [f'751{number:02d}' for number in range(1, 21)]},
+    'Bordeaux': {'dep': 33, 'flpm': FLPM_BDX, 'banco': BANCO_BDX, 'communes': ['33063']},
+    'Lille': {'dep': 59, 'flpm': FLPM_LIL, 'banco': BANCO_LIL, 'communes': ['59350']},
+}
+
+
+# TIMEOUTS #
+
+# délai maximum (connexion, lecture) en secondes, par service
+TIMEOUTS = {
+    'api-adresse.data.gouv.fr': (3.05, 5),
+    'pyris.datajazz.io': (3.05, 5),
+    'api.pappers.fr': (3.05, 10),
+    'data.ratp.fr': (3.05, 8),
+    'opendata.paris.fr': (3.05, 8),
+    'data.bordeaux-metropole.fr': (3.05, 8),
+    'opendata.lillemetropole.fr': (3.05, 8),
+}
+
+# CACHE DES RÉPONSES #
+
+# durée de conservation des réponses en secondes, par service (0 : jamais en cache)
+# Pappers n'y figure pas : ses fiches sont déjà conservées par owners.py (PAPPERS_TTL)
+DAY = 24 * 3600
+CACHE_TTL = {
+    'api-adresse.data.gouv.fr': 30 * DAY,
+    'pyris.datajazz.io': 365 * DAY,         # les contours IRIS ne changent presque jamais
+    'data.ratp.fr': 7 * DAY,
+    'opendata.paris.fr': 7 * DAY,
+    'data.bordeaux-metropole.fr': 7 * DAY,
+    'opendata.lillemetropole.fr': 7 * DAY,
+}
+# jeux de données en temps réel (disponibilité des vélos), prioritaires sur le service
+CACHE_TTL_DATASETS = {
+    'velib-disponibilite-en-temps-reel': 300,
+    'ci_vcub_p': 300,
+    'vlille-realtime': 300,
+}
+CACHE_SIZE = 50000      # nombre maximum de réponses conservées
+
+
+# MESURES #
+
+# point de collecte Prometheus (GET /metrics) de l'application, désactivé par défaut :
+# POPMYDATA_METRICS_PORT=9108 l'active, sur la boucle locale sauf si POPMYDATA_METRICS_HOST est indiqué
+METRICS_PORT = int(os.environ['POPMYDATA_METRICS_PORT']) if os.environ.get('POPMYDATA_METRICS_PORT') else None
+METRICS_HOST = os.environ.get('POPMYDATA_METRICS_HOST', '127.0.0.1')
@@ -0,0 +1,231 @@
+# STOCKAGE COLONNAIRE DES DONNÉES #
+#
+# Étape d'ingestion : chaque fichier du dossier Data est converti une fois pour toutes au format Feather
+# (colonnes typées, coordonnées en float32, textes répétés en catégories, entiers au plus petit type),
+# relu ensuite en mémoire mappée par l'application. Les tables chargées sont partagées entre les sessions :
+# elles sont en lecture seule (read_only), les colonnes calculées pour une recherche vivent dans des tableaux
+# à part ou dans une copie.
+#
+#   python datastore.py                 # convertit tous les fichiers de Data/
+#   python datastore.py <url> --sep ';' # convertit une source distante
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data')
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+MANIFEST = 'manifest.json'
+
+COORD_COLUMNS = ['X', 'Y', 'Xlong', 'Ylat', 'lat', 'lon']
+CATEGORY_RATIO = 0.5        # une colonne de texte devient une catégorie si elle a moins de valeurs distinctes
+
+_manifests = {}             # chemin du manifeste -> (date de modification, taille, contenu)
+
+
+def dataset_name(source):
+    """
+    Name of a dataset in the store, from its path or url
+    :param source: path or url of a csv file
+    :return: a string (lowercase file name without extension)
+    """
+    return os.path.splitext(os.path.basename(source.split('?')[0]))[0].lower()
+
+
+def parse_coordinates(frame):
+    """
+    Splits the "(lat, lon)" strings of the column coord_geo in two float32 columns lat and lon,
+    and stores every coordinate column in float32
+    :param frame: a dataframe
+    :return: the typed dataframe
+    """
+    if 'coord_geo' in frame.columns:
+        coords = frame['coord_geo'].astype(str).str.strip('()[] ').str.split(',', n=1, expand=True)
+        frame = frame.drop(columns='coord_geo')
+        frame['lat'] = pd.to_numeric(coords[0], errors='coerce')
+        frame['lon'] = pd.to_numeric(coords[1], errors='coerce')
+    for column in COORD_COLUMNS:
+        if column in frame.columns:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype(np.float32)
+    return frame
+
+
+def compact(frame):
+    """
+    Dictionary-encodes the repeated strings (categories) and stores the integers in the smallest type
+    :param frame: a dataframe
+    :return: the compacted dataframe
+    """
+    for column in frame.columns:
+        values = frame[column]
+        if column in COORD_COLUMNS:
+            continue
+        if values.dtype == object and values.nunique() <= CATEGORY_RATIO * len(values):
+            frame[column] = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            frame[column] = pd.to_numeric(values, downcast='integer')
+    return frame
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Content hash of a file
+    :param path: path of the file
+    :return: the sha256 of the content (hex string)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_manifest(store=STORE_DIR):
+    """
+    Manifest of the store, parsed again only when the file changed (version is called on every search)
+    :return: a dict {name: {source, sha256, rows, columns}}, shared: not to be modified
+    """
+    path = os.path.join(store, MANIFEST)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    cached = _manifests.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    _manifests[path] = (stat.st_mtime_ns, stat.st_size, manifest)
+    return manifest
+
+
+def read_manifest(store=STORE_DIR):
+    """
+    Description of the datasets of the store
+    :return: a dict {name: {source, sha256, rows, columns}}
+    """
+    return dict(cached_manifest(store))
+
+
+def write_manifest(manifest, store=STORE_DIR):
+    path = os.path.join(store, MANIFEST)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2, ensure_ascii=False)
+    _manifests.pop(path, None)
+
+
+def ingest(source, sep=',', store=STORE_DIR, name=None):
+    """
+    Converts a csv file (local or remote) into a Feather file of the store
+    :param source: path or url of the csv file
+    :param sep: separator of the csv file
+    :param store: directory of the store
+    :param name: name of the dataset, by default the name of the file
+    :return: the entry of the manifest
+    """
+    frame = compact(parse_coordinates(pd.read_csv(source, sep=sep, low_memory=False)))
+    return write_dataset(frame, source, store=store, name=name)
+
+
+def write_dataset(frame, source, store=STORE_DIR, name=None):
+    """
+    Stores a dataframe as a Feather file of the store and records it in the manifest
+    :param frame: the dataframe
+    :param source: path or url the data comes from
+    :param store: directory of the store
+    :param name: name of the dataset, by default the name of the source
+    :return: the entry of the manifest
+    """
+    from pyarrow import feather
+
+    name = name or dataset_name(source)
+    os.makedirs(store, exist_ok=True)
+    frame = frame.reset_index(drop=True)
+    path = os.path.join(store, f'{name}.feather')
+    feather.write_feather(frame, path, compression='uncompressed')    # non compressé : lisible en mémoire mappée
+
+    entry = {
+        'source': source,
+        'sha256': file_hash(path),
+        'rows': len(frame),
+        'columns': {column: str(dtype) for column, dtype in frame.dtypes.items()},
+    }
+    manifest = read_manifest(store)
+    manifest[name] = entry
+    write_manifest(manifest, store)
+    return entry
+
+
+def ingest_all(data_dir=DATA_DIR, store=STORE_DIR):
+    """
+    Converts every csv file of the data directory
+    :return: the manifest
+    """
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.lower().endswith('.csv'):
+            ingest(os.path.join(data_dir, file_name), store=store)
+    return read_manifest(store)
+
+
+def version(source, store=STORE_DIR):
+    """
+    Content hash of a dataset of the store, to be used as a cache key
+    :param source: path or url of the original csv file
+    :return: the sha256 of the stored file, None if the dataset is not in the store
+    """
+    entry = cached_manifest(store).get(dataset_name(source))
+    return entry['sha256'] if entry else None
+
+
+def read_only(frame):
+    """
+    Makes the values of a dataframe read-only: any in-place write (loc, iloc, values[...] = ...) raises
+    ValueError instead of changing the table shared by the sessions. Adding or replacing a column is still possible
+    and must be done on a copy.
+    :param frame: a dataframe
+    :return: the same dataframe
+    """
+    for array in frame._mgr.arrays:                 # tableaux des blocs (une colonne par bloc avec Feather)
+        array = getattr(array, '_ndarray', array)   # codes des catégories
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+    return frame
+
+
+def read_dataset(source, sep=',', store=STORE_DIR):
+    """
+    Reads a dataset from the store (memory mapped) or, if it was not ingested, from the csv file
+    :param source: path or url of the original csv file
+    :param sep: separator of the csv file
+    :return: a compact dataframe with typed coordinates, read-only (see read_only)
+    """
+    path = os.path.join(store, f'{dataset_name(source)}.feather')
+    if os.path.exists(path):
+        from pyarrow import feather
+        # une colonne par bloc : pas de copie pour regrouper les colonnes de même type
+        return read_only(feather.read_table(path, memory_map=True).to_pandas(split_blocks=True))
+    return read_only(compact(parse_coordinates(pd.read_csv(source, sep=sep, low_memory=False))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversion des fichiers de données au format colonnaire")
+    parser.add_argument('sources', nargs='*', help='fichiers ou urls à convertir (par défaut tout le dossier Data)')
+    parser.add_argument('--sep', default=',', help='séparateur des fichiers csv')
+    parser.add_argument('--store', default=STORE_DIR, help='dossier de destination')
+    args = parser.parse_args()
+
+    if args.sources:
+        for source in args.sources:
+            ingest(source, sep=args.sep, store=args.store)
+    else:
+        ingest_all(store=args.store)
+    for name, entry in read_manifest(args.store).items():
+        print(f"{name:<30} {entry['rows']:>8} lignes  {entry['sha256'][:12]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# DENSITÉ COMMERCIALE PRÉCALCULÉE #
+#
+# Calcul hors ligne, pour chaque ville, de la densité des commerces BANCO (toutes catégories et par
+# catégorie de la carte) sur une grille régulière : comptage par cellule puis lissage par un noyau gaussien,
+# la convolution étant faite par FFT. La carte affiche ces surfaces comme des images découpées autour de
+# l'adresse, au lieu d'envoyer les points au navigateur pour les heatmaps, et la densité en un point
+# se lit directement dans la grille.
+#
+#   python density.py                   # toutes les villes
+#   python density.py --city Lille --cell 25 --bandwidth 100
+
+import argparse
+import os
+
+import numpy as np
+
+import datastore
+from config import CITIES
+from maps import CATEGORIES
+from spatial_index import project, unproject
+
+ALL = 'all'
+CELL_SIZE = 25          # côté des cellules en mètres
+BANDWIDTH = 100         # écart type du noyau gaussien en mètres
+MARGIN = 500            # marge autour des commerces, en mètres
+
+
+def density_path(city, store=datastore.STORE_DIR):
+    return os.path.join(store, f'density_{city.lower()}.npz')
+
+
+def gaussian_kernel(bandwidth, cell_size):
+    """
+    Normalized gaussian kernel, truncated at 3 standard deviations
+    :return: a square array which sums to 1
+    """
+    half = int(np.ceil(3 * bandwidth / cell_size))
+    steps = np.arange(-half, half + 1) * cell_size
+    kernel = np.exp(-(steps[:, None] ** 2 + steps[None, :] ** 2) / (2 * bandwidth ** 2))
+    return kernel / kernel.sum()
+
+
+def fft_convolve(layers, kernel):
+    """
+    Convolution of every layer by the kernel, output of the same size as the layers
+    :param layers: array (layers x rows x columns)
+    :param kernel: square array with an odd side
+    :return: array of the same shape as layers
+    """
+    rows, cols = layers.shape[1:]
+    size = (rows + kernel.shape[0] - 1, cols + kernel.shape[1] - 1)
+    spectrum = np.fft.rfft2(layers, s=size) * np.fft.rfft2(kernel, s=size)
+    full = np.fft.irfft2(spectrum, s=size)
+    half = kernel.shape[0] // 2
+    return np.clip(full[:, half:half + rows, half:half + cols], 0, None)
+
+
+class DensityRaster:
+    """
+    Density of shops (per hectare) of a city, one layer per category, rows from south to north in the
+    local projection of spatial_index
+    """
+
+    def __init__(self, city, origin, cell_size, x0, y0, names, layers, version=None):
+        self.city = city
+        self.origin = tuple(origin)
+        self.cell_size = cell_size
+        self.x0, self.y0 = x0, y0
+        self.names = list(names)
+        self.layers = layers
+        self.version = version
+
+    @property
+    def shape(self):
+        return self.layers.shape[1:]
+
+    def save(self, path):
+        np.savez_compressed(path, city=self.city, origin=np.array(self.origin), cell_size=self.cell_size,
+                            x0=self.x0, y0=self.y0, names=np.array(self.names), layers=self.layers.astype(np.float16),
+                            version=str(self.version))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as file:
+            return cls(str(file['city']), file['origin'], float(file['cell_size']), float(file['x0']),
+                       float(file['y0']), [str(name) for name in file['names']], file['layers'].astype(np.float32),
+                       str(file['version']))
+
+    def value(self, lat, lon, category=ALL):
+        """
+        Density of shops at a location
+        :param category: BANCO type (see maps.CATEGORIES) or 'all'
+        :return: shops per hectare, None if the location is outside of the raster
+        """
+        x, y = project([lat], [lon], self.origin)
+        row = int(np.floor((y[0] - self.y0) / self.cell_size))
+        col = int(np.floor((x[0] - self.x0) / self.cell_size))
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return float(self.layers[self.names.index(category), row, col])
+        return None
+
+    def window(self, coord, radius):
+        """
+        Rows and columns of the cells within radius meters of a location
+        :return: two slices
+        """
+        x, y = project([coord[0]], [coord[1]], self.origin)
+        rows, cols = self.shape
+        row0 = int(np.clip(np.floor((y[0] - radius - self.y0) / self.cell_size), 0, rows))
+        row1 = int(np.clip(np.ceil((y[0] + radius - self.y0) / self.cell_size), 0, rows))
+        col0 = int(np.clip(np.floor((x[0] - radius - self.x0) / self.cell_size), 0, cols))
+        col1 = int(np.clip(np.ceil((x[0] + radius - self.x0) / self.cell_size), 0, cols))
+        return slice(row0, row1), slice(col0, col1)
+
+    def overlay(self, category=ALL, coord=None, radius=None):
+        """
+        Colored image of a layer (transparent to red), cut around a location
+        :param coord: centre of the image, the whole city if None
+        :param radius: half side of the image in meters
+        :return: a tuple (rgba image with the north at the top, [[south, west], [north, east]]), None if empty
+        """
+        layer = self.layers[self.names.index(category)]
+        rows, cols = (slice(None), slice(None)) if coord is None else self.window(coord, radius)
+        cut = layer[rows, cols]
+        if cut.size == 0:
+            return None
+        peak = float(layer.max())
+        level = np.clip(cut / peak, 0, 1)[::-1] if peak > 0 else np.zeros_like(cut)[::-1]
+        image = np.zeros(level.shape + (4,))
+        image[..., 0] = 1                                   # jaune -> rouge
+        image[..., 1] = 1 - level
+        image[..., 3] = np.where(level > 0.02, 0.2 + 0.6 * level, 0)
+
+        row0, col0 = rows.start or 0, cols.start or 0
+        x = [self.x0 + col0 * self.cell_size, self.x0 + (col0 + cut.shape[1]) * self.cell_size]
+        y = [self.y0 + row0 * self.cell_size, self.y0 + (row0 + cut.shape[0]) * self.cell_size]
+        lats, lons = unproject(x * 2, [y[0]] * 2 + [y[1]] * 2, self.origin)
+        return image, [[float(lats.min()), float(lons.min())], [float(lats.max()), float(lons.max())]]
+
+
+def build_density(shops, city, cell_size=CELL_SIZE, bandwidth=BANDWIDTH, margin=MARGIN, version=None):
+    """
+    Density surfaces of the shops of a city
+    :param shops: dataframe with BANCO data (X longitude, Y latitude, type)
+    :param cell_size: side of a cell in meters
+    :param bandwidth: standard deviation of the gaussian kernel in meters
+    :return: a DensityRaster
+    """
+    lats, lons = shops['Y'].to_numpy(dtype=float), shops['X'].to_numpy(dtype=float)
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    origin = (float(lats[valid].mean()), float(lons[valid].mean()))
+    x, y = project(lats[valid], lons[valid], origin)
+    x0, y0 = float(x.min() - margin), float(y.min() - margin)
+    cols = int(np.ceil((x.max() + margin - x0) / cell_size))
+    rows = int(np.ceil((y.max() + margin - y0) / cell_size))
+
+    # comptage des commerces par cellule, une couche par catégorie
+    types = shops['type'].to_numpy()[valid]
+    names = [ALL] + list(CATEGORIES)
+    counts = np.zeros((len(names), rows, cols))
+    row = np.clip(((y - y0) // cell_size).astype(int), 0, rows - 1)
+    col = np.clip(((x - x0) // cell_size).astype(int), 0, cols - 1)
+    np.add.at(counts[0], (row, col), 1)
+    for number, shop_type in enumerate(CATEGORIES, start=1):
+        selected = types == shop_type
+        np.add.at(counts[number], (row[selected], col[selected]), 1)
+
+    hectares = cell_size ** 2 / 10000
+    layers = fft_convolve(counts, gaussian_kernel(bandwidth, cell_size)) / hectares
+    return DensityRaster(city, origin, cell_size, x0, y0, names, layers.astype(np.float32), version)
+
+
+def load_density(city, store=datastore.STORE_DIR):
+    """
+    Precomputed density of a city
+    :return: a DensityRaster, None if it was not computed or if the shops changed since
+    """
+    path = density_path(city, store)
+    if not os.path.exists(path):
+        return None
+    raster = DensityRaster.load(path)
+    if raster.version != str(datastore.version(CITIES[city]['banco'])):
+        return None
+    return raster
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Précalcul de la densité commerciale des villes')
+    parser.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    parser.add_argument('--cell', type=float, default=CELL_SIZE, help='taille des cellules en mètres')
+    parser.add_argument('--bandwidth', type=float, default=BANDWIDTH, help='écart type du noyau en mètres')
+    args = parser.parse_args()
+
+    os.makedirs(datastore.STORE_DIR, exist_ok=True)
+    for city in args.city or list(CITIES):
+        url = CITIES[city]['banco']
+        raster = build_density(datastore.read_dataset(url), city, args.cell, args.bandwidth,
+                               version=datastore.version(url))
+        raster.save(density_path(city))
+        print(f'{city:<10} {raster.shape[0]} x {raster.shape[1]} cellules, {len(raster.names)} couches')
+
+
+if __name__ == '__main__':
+    main()
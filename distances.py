@@ -0,0 +1,108 @@
+# MOTEUR DE CALCUL DES DISTANCES #
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8        # rayon moyen de la Terre (m)
+WGS84_A = 6378137.0             # demi grand axe de l'ellipsoide WGS-84 (m)
+WGS84_F = 1 / 298.257223563     # aplatissement de l'ellipsoide WGS-84
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+def haversine(point, lats, lons):
+    """
+    Great-circle distances between one point and arrays of coordinates (spherical Earth)
+    :param point: a tuple of geographic coordinates (lat, lon)
+    :param lats: array of latitudes in degrees
+    :param lons: array of longitudes in degrees
+    :return: a numpy array of distances in meters
+    """
+    lat0, lon0 = np.radians(point[0]), np.radians(point[1])
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+
+    a = (np.sin((lats - lat0) / 2) ** 2
+         + np.cos(lat0) * np.cos(lats) * np.sin((lons - lon0) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(point, lats, lons, iterations=20, tolerance=1e-12):
+    """
+    Ellipsoidal distances (WGS-84, Vincenty inverse formula) between one point and arrays of coordinates.
+    All rows are solved together, the iteration stops once every row has converged.
+    :param point: a tuple of geographic coordinates (lat, lon)
+    :param lats: array of latitudes in degrees
+    :param lons: array of longitudes in degrees
+    :param iterations: maximum number of iterations
+    :param tolerance: convergence threshold on lambda (radians)
+    :return: a numpy array of distances in meters
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(point[0])))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lats)))
+    delta_lon = np.radians(lons - point[1])
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lamb = delta_lon.copy()
+    for _ in range(iterations):
+        sin_lamb, cos_lamb = np.sin(lamb), np.cos(lamb)
+        sin_sigma = np.hypot(cos_u2 * sin_lamb, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lamb)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lamb
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sin_alpha = np.where(sin_sigma == 0, 0, cos_u1 * cos_u2 * sin_lamb / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+        c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        previous = lamb
+        lamb = delta_lon + (1 - c) * WGS84_F * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if np.all(np.abs(lamb - previous) < tolerance):
+            break
+
+    u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return WGS84_B * big_a * (sigma - delta_sigma)
+
+
+METHODS = {
+    'haversine': haversine,
+    'ellipsoid': vincenty,
+}
+
+
+def distances(point, lats, lons, method='haversine'):
+    """
+    Distances between the searched address and a set of locations, in a single numpy pass
+    :param point: a tuple of geographic coordinates (lat, lon)
+    :param lats: array (or Series) of latitudes in degrees
+    :param lons: array (or Series) of longitudes in degrees
+    :param method: 'haversine' (fast, spherical) or 'ellipsoid' (WGS-84, same as geopy)
+    :return: a numpy array of distances in meters
+    """
+    try:
+        compute = METHODS[method]
+    except KeyError:
+        raise ValueError(f"Unknown distance method '{method}', choose among {list(METHODS)}")
+    return compute(point, lats, lons)
+
+
+def distances_pairs(point, coords, method='haversine', order='latlon'):
+    """
+    Same as distances but for a list of coordinate pairs as returned by the APIs
+    :param point: a tuple of geographic coordinates (lat, lon)
+    :param coords: iterable of pairs, (lat, lon) or (lon, lat) according to order
+    :param method: 'haversine' or 'ellipsoid'
+    :param order: 'latlon' or 'lonlat' (GeoJSON)
+    :return: a numpy array of distances in meters
+    """
+    pairs = np.asarray(list(coords), dtype=float).reshape(-1, 2)
+    if order == 'lonlat':
+        pairs = pairs[:, ::-1]
+    return distances(point, pairs[:, 0], pairs[:, 1], method=method)
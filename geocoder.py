@@ -0,0 +1,157 @@
+# GÉOCODAGE LOCAL DES ADRESSES #
+#
+# Les adresses de la Base Adresse Nationale (fichiers adresses-<département>.csv.gz, séparateur ';')
+# des villes de config.CITIES sont converties une fois dans le stockage colonnaire, puis indexées en
+# mémoire par (ville, rue normalisée) avec les numéros triés. Un numéro absent est interpolé entre les
+# numéros voisins du même côté de la rue. L'API Adresse n'est interrogée que si la rue est inconnue.
+#
+#   python geocoder.py adresses-33.csv.gz adresses-59.csv.gz adresses-75.csv.gz
+
+import argparse
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import datastore
+from config import CITIES
+
+DATASET = 'adresses'
+BAN_COLUMNS = ['numero', 'rep', 'nom_voie', 'code_postal', 'code_insee', 'nom_commune', 'lon', 'lat']
+
+
+def address_key(text):
+    """
+    Comparable form of a street or city name: uppercase, without accents nor punctuation
+    :param text: a string
+    :return: a string
+    """
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r'[^A-Z0-9]', ' ', text.upper()).split())
+
+
+def read_ban(source, cities=None):
+    """
+    Addresses of a BAN file, restricted to the cities.
+    The communes are selected by INSEE code, not by name: BAN names Paris by arrondissement
+    ("Paris 12e Arrondissement").
+    :param source: path or url of a BAN csv file
+    :param cities: names of the cities to keep (config.CITIES by default)
+    :return: a dataframe (city, street, numero, rep, nom_voie, code_postal, code_insee, nom_commune, lat, lon)
+    """
+    communes = {code: address_key(city) for city in (cities or CITIES) for code in CITIES[city]['communes']}
+    frame = pd.read_csv(source, sep=';', usecols=BAN_COLUMNS,
+                        dtype={'rep': str, 'code_postal': str, 'code_insee': str}, low_memory=False)
+    frame['city'] = frame['code_insee'].str.zfill(5).map(communes)
+    frame = frame[frame['city'].notna()].copy()
+    frame['street'] = frame['nom_voie'].map(address_key)
+    frame['numero'] = pd.to_numeric(frame['numero'], errors='coerce')
+    return frame.dropna(subset=['numero', 'lat', 'lon'])
+
+
+def ingest(sources, cities=None, store=datastore.STORE_DIR):
+    """
+    Converts BAN files into the address dataset of the store
+    :return: the entry of the manifest
+    """
+    frame = pd.concat([read_ban(source, cities) for source in sources], ignore_index=True)
+    frame = datastore.compact(datastore.parse_coordinates(frame))
+    return datastore.write_dataset(frame, ' '.join(sources), store=store, name=DATASET)
+
+
+class LocalGeocoder:
+    """
+    In-memory index of the addresses: for each (city, street), the numbers in ascending order with their coordinates
+    """
+
+    def __init__(self, addresses):
+        """
+        :param addresses: dataframe with the columns city, street, numero, nom_voie, code_postal, nom_commune, lat, lon
+        """
+        # une seule position par numéro (le numéro sans indice de répétition passe en premier)
+        addresses = addresses.assign(numero=addresses['numero'].astype(np.int64),
+                                     has_rep=addresses['rep'].notna() if 'rep' in addresses else False)
+        addresses = addresses.sort_values(['city', 'street', 'numero', 'has_rep'], kind='stable')
+        addresses = addresses.drop_duplicates(['city', 'street', 'numero'], keep='first').reset_index(drop=True)
+        self.numbers = addresses['numero'].to_numpy()
+        self.lats = addresses['lat'].to_numpy(dtype=float)
+        self.lons = addresses['lon'].to_numpy(dtype=float)
+        self.names = addresses['nom_voie'].to_numpy()
+        self.postcodes = addresses['code_postal'].astype(str).to_numpy()
+        self.communes = addresses['nom_commune'].to_numpy()
+
+        keys = list(zip(addresses['city'], addresses['street']))
+        bounds = np.flatnonzero([True] + [a != b for a, b in zip(keys[:-1], keys[1:])] + [True])
+        self.streets = {keys[start]: (start, end) for start, end in zip(bounds[:-1], bounds[1:])}
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def position(self, numb, start, end):
+        """
+        Coordinates of a number of a street
+        :return: a tuple (lat, lon, precision), precision being 'housenumber', 'interpolation' or 'street'
+        """
+        numbers = self.numbers[start:end]
+        found = int(np.searchsorted(numbers, numb))
+        if found < len(numbers) and numbers[found] == numb:
+            return self.lats[start + found], self.lons[start + found], 'housenumber'
+
+        # les numéros pairs et impairs sont de part et d'autre de la rue
+        side = np.flatnonzero(numbers % 2 == numb % 2)
+        if len(side) == 0:
+            side = np.arange(len(numbers))
+        lower, upper = side[numbers[side] < numb], side[numbers[side] > numb]
+        if len(lower) > 0 and len(upper) > 0:
+            low, high = start + lower[-1], start + upper[0]
+            share = (numb - self.numbers[low]) / (self.numbers[high] - self.numbers[low])
+            return (self.lats[low] + share * (self.lats[high] - self.lats[low]),
+                    self.lons[low] + share * (self.lons[high] - self.lons[low]), 'interpolation')
+        nearest = start + (lower[-1] if len(lower) > 0 else upper[0])
+        return self.lats[nearest], self.lons[nearest], 'street'
+
+    def geocode(self, numb, street, city):
+        """
+        Geographic coordinates of an address
+        :param numb: number in the street
+        :param street: name of the street
+        :param city: name of the city
+        :return: a dict {lat, lon, label, precision} or None if the street is unknown
+        """
+        bounds = self.streets.get((address_key(city), address_key(street)))
+        if bounds is None:
+            return None
+        try:
+            numb = int(float(numb))
+        except (TypeError, ValueError):
+            numb = int(self.numbers[bounds[0]])
+        lat, lon, precision = self.position(numb, *bounds)
+        start = bounds[0]
+        label = f'{numb} {self.names[start]} {self.postcodes[start]} {self.communes[start]}'
+        return {'lat': float(lat), 'lon': float(lon), 'label': label, 'precision': precision}
+
+
+def load_geocoder(store=datastore.STORE_DIR):
+    """
+    Index of the addresses of the store
+    :return: a LocalGeocoder, None if no BAN file was converted
+    """
+    if not os.path.exists(os.path.join(store, f'{DATASET}.feather')):
+        return None
+    return LocalGeocoder(datastore.read_dataset(DATASET, store=store))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conversion des adresses de la Base Adresse Nationale')
+    parser.add_argument('sources', nargs='+', help='fichiers csv de la BAN (adresses-<département>.csv.gz)')
+    parser.add_argument('--city', action='append', help='ville à conserver (par défaut celles de config.CITIES)')
+    args = parser.parse_args()
+
+    entry = ingest(args.sources, args.city)
+    print(f"{entry['rows']} adresses")
+
+
+if __name__ == '__main__':
+    main()
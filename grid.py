@@ -0,0 +1,294 @@
+# GRILLE PRÉCALCULÉE DE L'INDICE D'ATTRACTIVITÉ #
+#
+# Calcul hors ligne, pour chaque cellule d'une grille régulière (50m par défaut) couvrant une ville,
+# des indicateurs qui ne dépendent que de la position : commerces BANCO (200m), équipements BPE,
+# parkings et métro parisien (400m). L'application lit ensuite la cellule de l'adresse au lieu
+# de refaire ces calculs, la population vient du code IRIS de l'adresse.
+# Les transports interrogés en direct (bus, vélos, réseaux de Bordeaux et Lille) ne sont pas dans la grille :
+# ils sont demandés aux API au moment de la lecture (voir CityGrid.score), sinon la note d'accessibilité
+# de ces villes serait sous-estimée.
+#
+#   python grid.py                  # toutes les villes
+#   python grid.py --city Paris --cell 50
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+import datastore
+from config import BPE, CITIES, FREQ_PRS, METRO_PRS
+from indices import rate_locations
+from parkings import parking_source
+from scoring import ScoringEngine, clean_metro_paris, rate_tables, transport_indicators
+from spatial_index import project, unproject
+
+BANCO_RADIUS = 200
+RADIUS = 400
+
+
+def grid_path(city, store=datastore.STORE_DIR):
+    return os.path.join(store, f'grid_{city.lower()}.npz')
+
+
+def sources_version(city):
+    """
+    Hash of the versions of the datasets used by the grid of a city
+    """
+    sources = [CITIES[city]['banco'], BPE, parking_source(CITIES[city]['dep']), METRO_PRS, FREQ_PRS]
+    versions = [str(datastore.version(url)) for url in sources]
+    return hashlib.sha256('|'.join(versions).encode()).hexdigest()
+
+
+class CityGrid:
+    """
+    Indicator totals of every cell of a city, stored as a (indicators x rows x columns) float32 array.
+    Rows go from south to north, columns from west to east, in the local projection of spatial_index.
+    """
+
+    def __init__(self, city, origin, cell_size, x0, y0, names, totals, version=None):
+        self.city = city
+        self.dep = CITIES[city]['dep']
+        self.origin = tuple(origin)
+        self.cell_size = cell_size
+        self.x0, self.y0 = x0, y0
+        self.names = list(names)
+        self.totals = totals
+        self.version = version
+        self._surface = None
+
+    @property
+    def shape(self):
+        return self.totals.shape[1:]
+
+    def save(self, path):
+        np.savez_compressed(path, city=self.city, origin=np.array(self.origin), cell_size=self.cell_size,
+                            x0=self.x0, y0=self.y0, names=np.array(self.names), totals=self.totals,
+                            version=str(self.version))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as file:
+            return cls(str(file['city']), file['origin'], float(file['cell_size']), float(file['x0']),
+                       float(file['y0']), [str(name) for name in file['names']], file['totals'],
+                       str(file['version']))
+
+    def centers(self):
+        """
+        Geographic coordinates of the centre of every cell
+        :return: two arrays (rows x columns) of latitudes and longitudes
+        """
+        rows, cols = self.shape
+        x = self.x0 + (np.arange(cols) + 0.5) * self.cell_size
+        y = self.y0 + (np.arange(rows) + 0.5) * self.cell_size
+        xx, yy = np.meshgrid(x, y)
+        return unproject(xx, yy, self.origin)
+
+    def cell(self, lat, lon):
+        """
+        Cell containing a location
+        :return: a tuple (row, column), None if the location is outside of the grid
+        """
+        x, y = project([lat], [lon], self.origin)
+        row = int(np.floor((y[0] - self.y0) / self.cell_size))
+        col = int(np.floor((x[0] - self.x0) / self.cell_size))
+        if 0 <= row < self.shape[0] and 0 <= col < self.shape[1]:
+            return row, col
+        return None
+
+    def indicators(self, lat, lon):
+        """
+        Values of the indicators of the cell of a location, as computed by scoring.indicators
+        :return: a dict {indicator: value}, None if the location is outside of the grid
+        """
+        cell = self.cell(lat, lon)
+        if cell is None:
+            return None
+        values = dict(zip(self.names, self.totals[:, cell[0], cell[1]].tolist()))
+        return self.to_indicators(values)
+
+    def to_indicators(self, values):
+        totals = {name: int(value) for name, value in values.items()}
+        shops = totals.pop('Tissu commercial')
+        bars, big = totals.pop('bars_restaurants'), totals.pop('grandes_enseignes')
+        totals['Tissu commercial'] = shops
+        if shops > 0:
+            totals['Proportion Restaurants/Bars'] = round(bars / shops * 100, 2)
+            totals['Proportion Grandes Enseignes'] = round(big / shops * 100, 2)
+            totals["Proportion d'Indépendants"] = round((shops - big) / shops * 100, 2)
+        return totals
+
+    def score(self, location, insee=None, transports=None):
+        """
+        Attractiveness index of a location read in the grid
+        :param location: a dict {lat, lon}
+        :param insee: row of the INSEE data for the IRIS of the location (None if unknown)
+        :param transports: dict returned by ScoringEngine.transports for the location, its indicators replace
+                           those of the grid; without it the real time transports are missing from the notes
+        :return: a dict as returned by ScoringEngine.score, None if the location is outside of the grid
+        """
+        totals = self.indicators(location['lat'], location['lon'])
+        if totals is None:
+            return None
+        if transports is not None:
+            totals.update(transport_indicators(self.dep, transports))
+        if insee is not None:
+            totals['Population Active'] = insee['Population Active']
+            totals['Revenu médian'] = insee['Revenus Medians']
+        return rate_tables(self.dep, totals)
+
+    def surface(self):
+        """
+        Note of every cell (visibility, accessibility and district, without population)
+        :return: an array (rows x columns) of notes
+        """
+        if self._surface is None:
+            flat = pd.DataFrame(self.totals.reshape(len(self.names), -1).T, columns=self.names).astype(int)
+            notes = rate_locations(flat, self.dep)
+            self._surface = notes['total'].to_numpy().reshape(self.shape)
+        return self._surface
+
+    def overlay(self, maximum=90):
+        """
+        Colored image of the surface, to be displayed over the map
+        :param maximum: note displayed in green
+        :return: a tuple (rgba image with the north at the top, [[south, west], [north, east]])
+        """
+        level = np.clip(self.surface() / maximum, 0, 1)[::-1]
+        image = np.zeros(level.shape + (4,))
+        image[..., 0] = np.clip(2 * (1 - level), 0, 1)      # rouge -> jaune -> vert
+        image[..., 1] = np.clip(2 * level, 0, 1)
+        image[..., 3] = np.where(self.surface()[::-1] > 0, 0.6, 0)
+        rows, cols = self.shape
+        corner_x = [self.x0, self.x0 + cols * self.cell_size] * 2
+        corner_y = [self.y0] * 2 + [self.y0 + rows * self.cell_size] * 2
+        lats, lons = unproject(corner_x, corner_y, self.origin)
+        bounds = [[float(lats.min()), float(lons.min())], [float(lats.max()), float(lons.max())]]
+        return image, bounds
+
+
+class PointIndicators:
+    """
+    Counts of the indicators which only depend on the position, for any location of a city:
+    shops (200m), parkings, equipments and Paris metro stations (400m). The values are the raw totals of
+    the grid (see to_indicators).
+    """
+
+    def __init__(self, engine, city):
+        """
+        :param engine: a ScoringEngine (datasets and spatial indexes)
+        :param city: name of the city
+        """
+        dep = CITIES[city]['dep']
+        self.city = city
+        self.banco, self.banco_index = engine.banco(city)
+        self.parking, self.park_index = engine.parking(dep)
+        self.bpe, self.bpe_index = engine.bpe(dep)
+
+        # attributs des points, pour compter sans repasser par pandas
+        self.is_mall = self.banco['type'].isin(['supermarket', 'mall']).to_numpy()
+        self.is_bar = self.banco['type'].isin(['bar', 'restaurant']).to_numpy()
+        self.is_big = (self.banco['cat_mag'] == 1).to_numpy()
+        self.equipment_codes, self.equipments = pd.factorize(self.bpe['Equipement'])
+
+        self.names = ['Tissu commercial', 'Centres Commerciaux', 'bars_restaurants', 'grandes_enseignes', 'Parking']
+        self.names += list(self.equipments)
+        if city == 'Paris':
+            # une station peut correspondre à plusieurs lignes de fréquentation (jointure de scoring.transports)
+            stations, self.metro_index = engine.metro_paris()
+            freq = engine.data(FREQ_PRS)
+            joined = pd.merge(pd.DataFrame({'row': range(len(stations)),
+                                            'Arrêt': stations['Arrêt'].apply(clean_metro_paris)}),
+                              freq, left_on='Arrêt', right_on='nom', how='left')
+            self.station_rows = joined.groupby('row').size().reindex(range(len(stations)), fill_value=0).to_numpy()
+            self.station_validations = joined.groupby('row')['validations'].sum().reindex(range(len(stations)),
+                                                                                          fill_value=0).to_numpy()
+            self.names += ['Metro/Tram', 'Nombre voyageurs Metro/Tram']
+        self.position = {name: number for number, name in enumerate(self.names)}
+
+    def values(self, point, out=None):
+        """
+        :param point: a tuple of geographic coordinates (lat, lon)
+        :param out: optional array of len(names) filled in place
+        :return: an array of the totals, in the order of names
+        """
+        values = np.zeros(len(self.names), dtype=np.float32) if out is None else out
+        equipments = len(self.equipments)
+
+        near, _ = self.banco_index.query_radius(point, BANCO_RADIUS)
+        values[0:4] = [len(near), self.is_mall[near].sum(), self.is_bar[near].sum(), self.is_big[near].sum()]
+
+        near, _ = self.park_index.query_radius(point, RADIUS)
+        values[4] = len(near)
+
+        near, _ = self.bpe_index.query_radius(point, RADIUS)
+        values[5:5 + equipments] = np.bincount(self.equipment_codes[near], minlength=equipments)
+
+        if self.city == 'Paris':
+            near, _ = self.metro_index.query_radius(point, RADIUS)
+            values[self.position['Metro/Tram']] = self.station_rows[near].sum()
+            values[self.position['Nombre voyageurs Metro/Tram']] = np.floor(np.nansum(self.station_validations[near]))
+        return values
+
+
+def build_grid(engine, city, cell_size=50, margin=RADIUS):
+    """
+    Computes the indicators of every cell of a city
+    :param engine: a ScoringEngine (datasets and spatial indexes)
+    :param city: name of the city
+    :param cell_size: side of a cell in meters
+    :param margin: distance in meters added around the shops of the city
+    :return: a CityGrid
+    """
+    indicators = PointIndicators(engine, city)
+    banco_index = indicators.banco_index
+
+    # emprise : les commerces de la ville, plus une marge
+    valid = np.isfinite(banco_index.lats) & np.isfinite(banco_index.lons)
+    origin = (float(banco_index.lats[valid].mean()), float(banco_index.lons[valid].mean()))
+    x, y = project(banco_index.lats[valid], banco_index.lons[valid], origin)
+    x0, y0 = float(x.min() - margin), float(y.min() - margin)
+    cols = int(np.ceil((x.max() + margin - x0) / cell_size))
+    rows = int(np.ceil((y.max() + margin - y0) / cell_size))
+
+    grid = CityGrid(city, origin, cell_size, x0, y0, indicators.names,
+                    np.zeros((len(indicators.names), rows, cols), dtype=np.float32), sources_version(city))
+    lats, lons = grid.centers()
+    for row in range(rows):
+        for col in range(cols):
+            indicators.values((lats[row, col], lons[row, col]), out=grid.totals[:, row, col])
+    return grid
+
+
+def load_grid(city, store=datastore.STORE_DIR):
+    """
+    Precomputed grid of a city
+    :return: a CityGrid, None if the grid was not computed or if its datasets changed since
+    """
+    path = grid_path(city, store)
+    if not os.path.exists(path):
+        return None
+    grid = CityGrid.load(path)
+    if grid.version != sources_version(city):
+        return None
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Précalcul de la grille de l'indice d'attractivité")
+    parser.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    parser.add_argument('--cell', type=float, default=50, help='taille des cellules en mètres')
+    args = parser.parse_args()
+
+    engine = ScoringEngine()
+    os.makedirs(datastore.STORE_DIR, exist_ok=True)
+    for city in args.city or list(CITIES):
+        grid = build_grid(engine, city, cell_size=args.cell)
+        grid.save(grid_path(city))
+        print(f'{city:<10} {grid.shape[0]} x {grid.shape[1]} cellules de {args.cell:g}m')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# CLIENT HTTP DES API #
+#
+# Une seule session (pool de connexions partagé), un délai maximum par service,
+# l'envoi simultané des requêtes indépendantes et, si besoin, un cache persistant des réponses.
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import TIMEOUTS
+
+DEFAULT_TIMEOUT = (3.05, 10)     # (connexion, lecture) en secondes
+
+
+class HttpClient:
+    """
+    Shared HTTP client: pooled connections, per-host timeouts and concurrent fan-out of independent calls
+    """
+
+    def __init__(self, session=None, timeouts=None, workers=8, cache=None):
+        """
+        :param session: a requests.Session (a new one with a connection pool by default)
+        :param timeouts: dict {host: timeout}, see config.TIMEOUTS
+        :param workers: maximum number of simultaneous calls, for each of the two pools
+        :param cache: a response_cache.ResponseCache (no cache by default)
+        """
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+        self.timeouts = TIMEOUTS if timeouts is None else timeouts
+        # pool : tâches des appelants (qui peuvent elles-mêmes appeler get_all), fanout : requêtes de get_all
+        # seulement, qui ne soumettent rien ; séparés pour qu'une tâche du pool n'attende jamais une requête
+        # bloquée derrière d'autres tâches du pool
+        self.pool = ThreadPoolExecutor(workers)
+        self.fanout = ThreadPoolExecutor(workers)
+        self.cache = cache
+
+    def timeout(self, url):
+        return self.timeouts.get(urlparse(url).hostname, DEFAULT_TIMEOUT)
+
+    def get(self, url, params=None, timeout=None):
+        """
+        GET request with the timeout of the host
+        :param url: url of the API
+        :param params: query parameters
+        :param timeout: overrides the timeout of the host
+        :return: a requests.Response
+        """
+        host = urlparse(url).hostname
+        if self.cache is not None:
+            body = self.cache.get(url, params)
+            metrics.count('http_cache', host=host, result='miss' if body is None else 'hit')
+            if body is not None:
+                response = requests.Response()
+                response.status_code, response.url, response._content = 200, url, body
+                response.encoding = 'utf-8'
+                return response
+        with metrics.span('http', host=host):
+            response = self.session.get(url, params=params, timeout=timeout or self.timeout(url))
+        metrics.count('http_requests', host=host, status=response.status_code)
+        metrics.count('http_bytes', len(response.content), host=host)
+        if self.cache is not None and response.status_code == 200:
+            self.cache.put(url, params, response.content)
+        return response
+
+    def post(self, url, data=None, headers=None, stream=False, timeout=None):
+        """
+        POST request with the timeout of the host, never cached
+        :param data: body of the request (bytes or a generator for a streamed upload)
+        :param stream: True to read the answer as it arrives
+        :return: a requests.Response
+        """
+        host = urlparse(url).hostname
+        with metrics.span('http', host=host):
+            response = self.session.post(url, data=data, headers=headers, stream=stream,
+                                         timeout=timeout or self.timeout(url))
+        metrics.count('http_requests', host=host, status=response.status_code)
+        return response
+
+    def get_all(self, calls):
+        """
+        Sends independent GET requests at the same time, on a pool of their own (safe to call from a task of pool)
+        :param calls: dict {name: url or (url, params)}
+        :return: dict {name: requests.Response}, the first error is raised once every call is over
+        """
+        futures = {}
+        for name, call in calls.items():
+            url, params = (call, None) if isinstance(call, str) else call
+            futures[name] = self.fanout.submit(metrics.propagate(self.get), url, params)
+        wait(futures.values())     # aucune requête ne reste en cours quand une erreur est levée
+        return {name: future.result() for name, future in futures.items()}
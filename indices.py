@@ -0,0 +1,170 @@
+#  CONSTRUCTEUR DES INDICES #
+#
+# Les barèmes des notes sont décrits sous forme de données : pour chaque indicateur, des paliers
+# (valeurs minimales, croissantes) et les notes correspondantes, la première note s'appliquant sous le
+# premier palier. Un barème peut dépendre du département ('default' s'applique aux autres).
+# Les mêmes barèmes notent une adresse (tableaux de locannuaire) ou des milliers d'emplacements d'un coup.
+
+import numpy as np
+import pandas as pd
+
+MAX_SOUS_INDICE = 30
+
+RULES = {
+    # INDICE DE VISIBILITÉ
+    'visibilite': {
+        'Nombre voyageurs Metro/Tram': {
+            75: ([5000, 10000, 20000], [0, 3, 6, 9]),                   # Paris : 5 000, 10 000, 20 000 voyageurs
+            59: ([2500, 5000, 10000], [0, 3, 6, 9]),                    # Lille : 2 500, 5 000, 10 000 voyageurs
+        },
+        'Tissu commercial': {
+            75: ([10, 20, 30, 40, 50, 70, 100], [0, 1, 3, 6, 10, 14, 17, 20]),            # Paris
+            59: ([10, 20, 30, 40, 50, 70, 100], [0, 1, 3, 6, 10, 14, 17, 20]),            # Lille
+            'default': ([10, 20, 30, 40, 50, 70, 100], [0, 1, 5, 10, 15, 20, 25, 30]),    # Bordeaux
+        },
+        # présence d'un centre commercial à proximité
+        'Centres Commerciaux': {
+            75: ([1], [0, 1]),
+            59: ([1], [0, 1]),
+            'default': ([1], [0, 3]),
+        },
+    },
+    # INDICE D'ACCESSIBILITÉ
+    'accessibilite': {
+        'Gare': {'default': ([1], [0, 2])},                             # 2 points s'il y a une gare
+        'Metro/Tram': {'default': ([1, 2, 3], [0, 3, 6, 10])},          # 3 points par arrêt, 10 au delà de 3
+        'Bus': {'default': ([1, 2, 3], [0, 1, 2, 6])},                  # 1 point par arrêt, 6 au delà de 3
+        'Velo_ls': {'default': ([1, 2, 3], [0, 2, 4, 6])},              # 2 points par borne, 6 au maximum
+        'Parking': {'default': ([1, 2, 3], [0, 2, 4, 6])},              # 2 points par parking, 6 au maximum
+    },
+    # INDICE DE POPULATION
+    'population': {
+        'Population Active': {'default': ([200, 1000, 2000], [0, 4, 10, 6])},
+        'Revenu médian': {'default': ([10000, 15000, 20000, 25000, 30000], [0, 2, 4, 6, 8, 10])},
+    },
+    # INDICE VIE DE QUARTIER
+    'quartier': {
+        'Bureau de poste': {'default': ([1], [0, 1])},
+        'École maternelle': {'default': ([1], [0, 1])},
+        'Enseignement Secondaire': {'default': ([1], [0, 1])},
+        'Enseignement supérieur': {'default': ([1, 2, 3, 4], [0, 1, 2, 3, 4])},      # 1 point par établissement
+        'Zone Sports': {'default': ([1], [0, 2])},
+        'Cinéma': {'default': ([1], [0, 2])},
+        'Espace Culturel': {'default': ([1], [0, 2])},
+        'Bibliothèque': {'default': ([1], [0, 1])},
+        'Hôtel': {'default': ([2, 4, 6, 8, 10, 12], [0, 1, 2, 3, 4, 5, 6])},          # 1 point pour 2 hôtels
+    },
+}
+
+
+def rules(indice, departement):
+    """
+    Barèmes d'un sous-indice pour un département
+    :param indice: nom du sous-indice (clé de RULES)
+    :param departement: departement où la recherche est effectuée
+    :return: un dict {indicateur: (paliers, notes)}
+    """
+    selected = {}
+    for indicator, scales in RULES[indice].items():
+        scale = scales.get(departement, scales.get('default'))
+        if scale is not None:
+            selected[indicator] = scale
+    return selected
+
+
+def ladder(values, paliers, notes):
+    """
+    Note de chaque valeur : la note du plus haut palier atteint (valeur >= palier).
+    Une valeur manquante n'atteint aucun palier (première note), comme dans les anciennes comparaisons.
+    :param values: tableau de valeurs (ou un nombre)
+    :param paliers: valeurs minimales des paliers, croissantes
+    :param notes: notes, une de plus que de paliers
+    :return: tableau numpy des notes
+    """
+    values = np.asarray(values, dtype=float)
+    notes = np.asarray(notes)
+    return np.where(np.isfinite(values), notes[np.searchsorted(paliers, values, side='right')], notes[0])
+
+
+def index_total(notes):
+    """
+    Note d'un sous-indice : somme des notes de ses indicateurs, entre 0 et 30
+    :param notes: tableau (emplacements x indicateurs) des notes
+    :return: tableau numpy des notes du sous-indice
+    """
+    return np.clip(np.asarray(notes).sum(axis=-1), 0, MAX_SOUS_INDICE)
+
+
+def rate_locations(totals, departement):
+    """
+    Notes de nombreux emplacements d'un même département, en une passe par indicateur
+    :param totals: dataframe avec une ligne par emplacement et une colonne par indicateur
+                   (les indicateurs absents valent 0)
+    :param departement: departement des emplacements
+    :return: dataframe des notes de chaque indicateur, de chaque sous-indice et de l'indice total
+    """
+    notes = pd.DataFrame(index=totals.index)
+    for indice in RULES:
+        columns = []
+        for indicator, (paliers, scores) in rules(indice, departement).items():
+            values = totals[indicator] if indicator in totals.columns else np.zeros(len(totals))
+            notes[indicator] = ladder(values, paliers, scores)
+            columns.append(indicator)
+        notes[indice] = index_total(notes[columns].to_numpy()) if columns else 0
+    notes['total'] = notes[list(RULES)].sum(axis=1)
+    return notes
+
+
+def apply_rules(table, indice, departement):
+    """
+    Ajoute la colonne avec les notes compte tenu de la valeur de chaque ligne
+    :param table: tableau avec les valeurs calculées par locannuaire
+    :param indice: nom du sous-indice (clé de RULES)
+    :param departement: departement où la recherche est effectuée
+    :return: retourne le tableau complété
+    """
+    for indicator, (paliers, notes) in rules(indice, departement).items():
+        if indicator in table.index:
+            table.loc[indicator, 'Note'] = int(ladder(table.loc[indicator, 'Total'], paliers, notes))
+    return table
+
+
+# Constructeur de l'INDICE DE VISIBILITÉ
+def visibility_rating(table, departement):
+    """
+    Ajoute la colonne avec les notes compte tenu de la valeur de chaque colonne
+    :param table: tableau avec les valeurs calculées par locannuaire
+    :param departement: departement où la recherche est effectuée
+    :return: retourne le tableau complété
+    """
+    return apply_rules(table, 'visibilite', departement)
+
+
+# Constructeur de l'INDICE D'ACCESSIBILITÉ
+def access_rating(table):
+    """
+    Ajoute la colonne avec les notes compte tenu de la valeur de chaque colonne
+    :param table: tableau avec les valeurs calculées par locannuaire
+    :return: retourne le tableau complété
+    """
+    return apply_rules(table, 'accessibilite', None)
+
+
+# Constructeur de l'INDICE DE POPULATION
+def population_rating(table):
+    """
+    Ajoute la colonne avec les notes compte tenu de la valeur de chaque colonne
+    :param table: tableau avec les valeurs calculées par locannuaire
+    :return: retourne le tableau complété
+    """
+    return apply_rules(table, 'population', None)
+
+
+# Constructeur de L'INDICE VIE DE QUARTIER
+def district_rating(table):
+    """
+    Ajoute la colonne avec les notes compte tenu de la valeur de chaque colonne
+    :param table: tableau avec les valeurs calculées par locannuaire
+    :return: retourne le tableau complété
+    """
+    return apply_rules(table, 'quartier', None)
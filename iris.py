@@ -0,0 +1,215 @@
+# RÉSOLUTION LOCALE DES CODES IRIS #
+#
+# Remplace l'appel à PYRIS : les contours IRIS (GeoJSON en WGS84, par exemple l'export « Contours IRIS »
+# de l'IGN) sont convertis une fois en tableaux numpy (arêtes des polygones et rectangles englobants),
+# puis chaque point est cherché dans les polygones dont le rectangle le contient (test pair-impair).
+#
+#   python iris.py contours_iris.geojson            # départements de config.CITIES
+#   python iris.py contours_iris.geojson --dep 75
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+import datastore
+from config import CITIES
+
+IRIS_PATH = os.path.join(datastore.STORE_DIR, 'iris.npz')
+CODE_PROPERTIES = ['CODE_IRIS', 'code_iris', 'iris_code', 'complete_code']
+CELL_SIZE = 0.01        # côté des cellules de l'index, en degrés (environ 1km)
+
+
+def polygon_rings(geometry):
+    """
+    Rings of a GeoJSON Polygon or MultiPolygon (outer rings and holes alike)
+    :return: a list of arrays (vertices x 2) of lon, lat
+    """
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [np.asarray(ring, dtype=float)[:, :2] for polygon in polygons for ring in polygon]
+
+
+def feature_code(properties):
+    for name in CODE_PROPERTIES:
+        code = properties.get(name)
+        if isinstance(code, list):
+            code = code[0] if code else None
+        if code:
+            return str(code)
+    return None
+
+
+def point_in_edges(lons, lats, edges):
+    """
+    Even-odd rule: a point is inside when a ray going east crosses an odd number of edges
+    :param lons: array of longitudes of the points
+    :param lats: array of latitudes of the points
+    :param edges: array (edges x 4) of lon1, lat1, lon2, lat2 of every ring of a polygon
+    :return: boolean array
+    """
+    x1, y1, x2, y2 = (edges[:, i][None, :] for i in range(4))
+    px, py = lons[:, None], lats[:, None]
+    straddle = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    return (straddle & (px < cross_x)).sum(axis=1) % 2 == 1
+
+
+class IrisResolver:
+    """
+    IRIS contours with a grid index on their bounding boxes
+    """
+
+    def __init__(self, codes, edges, offsets, bboxes, cell_size=CELL_SIZE):
+        """
+        :param codes: array of the IRIS codes
+        :param edges: array (edges x 4) of the edges of every polygon, polygon after polygon
+        :param offsets: first edge of every polygon (one more than polygons)
+        :param bboxes: array (polygons x 4) of min lon, min lat, max lon, max lat
+        :param cell_size: side of the cells of the index, in degrees
+        """
+        self.codes = np.asarray(codes).astype(str)
+        self.edges = np.asarray(edges, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.bboxes = np.asarray(bboxes, dtype=float)
+        self.cell_size = cell_size
+
+        # chaque polygone est rangé dans toutes les cellules que couvre son rectangle
+        low = np.floor(self.bboxes[:, :2] / cell_size).astype(np.int64)
+        high = np.floor(self.bboxes[:, 2:] / cell_size).astype(np.int64)
+        keys, polygons = [], []
+        for number, ((x0, y0), (x1, y1)) in enumerate(zip(low, high)):
+            xx, yy = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+            keys.append(self.key(xx.ravel(), yy.ravel()))
+            polygons.append(np.full(xx.size, number))
+        keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+        polygons = np.concatenate(polygons) if polygons else np.empty(0, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        self.polygons = polygons[order]
+        self.keys, self.starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.ends = self.starts + counts
+
+    def __len__(self):
+        return len(self.codes)
+
+    @staticmethod
+    def key(cell_x, cell_y):
+        return (np.asarray(cell_x, dtype=np.int64) << 32) + (np.asarray(cell_y, dtype=np.int64) + (1 << 31))
+
+    @classmethod
+    def from_geojson(cls, source, departments=None):
+        """
+        :param source: path of a GeoJSON file of IRIS contours in WGS84
+        :param departments: departments to keep (all by default)
+        :return: an IrisResolver
+        """
+        with open(source, encoding='utf-8') as file:
+            features = json.load(file)['features']
+        prefixes = None if departments is None else tuple(f'{dep:02d}' if isinstance(dep, int) else str(dep)
+                                                          for dep in departments)
+        codes, edges, offsets, bboxes = [], [], [0], []
+        for feature in features:
+            code = feature_code(feature.get('properties') or {})
+            if code is None or not feature.get('geometry') or (prefixes and not code.startswith(prefixes)):
+                continue
+            rings = polygon_rings(feature['geometry'])
+            if not rings:
+                continue
+            polygon = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+            vertices = np.concatenate(rings)
+            codes.append(code)
+            edges.append(polygon)
+            offsets.append(offsets[-1] + len(polygon))
+            bboxes.append([*vertices.min(axis=0), *vertices.max(axis=0)])
+        return cls(np.array(codes), np.concatenate(edges) if edges else np.empty((0, 4)),
+                   np.array(offsets), np.array(bboxes).reshape(-1, 4))
+
+    def save(self, path=IRIS_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, codes=self.codes, edges=self.edges, offsets=self.offsets, bboxes=self.bboxes)
+
+    @classmethod
+    def load(cls, path=IRIS_PATH):
+        with np.load(path) as file:
+            return cls(file['codes'], file['edges'], file['offsets'], file['bboxes'])
+
+    def lookup(self, lats, lons):
+        """
+        IRIS codes of many points
+        :param lats: array of latitudes
+        :param lons: array of longitudes
+        :return: an object array of codes (None for the points outside of every contour)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        result = np.full(len(lats), None, dtype=object)
+        if len(self.keys) == 0 or len(lats) == 0:
+            return result
+
+        # couples (point, polygone candidat) : polygones rangés dans la cellule du point
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        keys = self.key(np.floor(np.where(valid, lons, 0) / self.cell_size),
+                        np.floor(np.where(valid, lats, 0) / self.cell_size))
+        pos = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys) - 1)
+        found = valid & (self.keys[pos] == keys)
+        counts = np.where(found, self.ends[pos] - self.starts[pos], 0)
+        points = np.repeat(np.arange(len(lats)), counts)
+        first = np.repeat(self.starts[pos] - np.cumsum(counts) + counts, counts)
+        polygons = self.polygons[first + np.arange(len(points))]
+
+        # préfiltre sur les rectangles englobants, puis test exact polygone par polygone
+        box = self.bboxes[polygons]
+        inside = ((box[:, 0] <= lons[points]) & (lons[points] <= box[:, 2])
+                  & (box[:, 1] <= lats[points]) & (lats[points] <= box[:, 3]))
+        points, polygons = points[inside], polygons[inside]
+        resolved = np.zeros(len(lats), dtype=bool)
+        for polygon in np.unique(polygons):
+            tested = points[polygons == polygon]
+            tested = tested[~resolved[tested]]
+            if len(tested) == 0:
+                continue
+            edges = self.edges[self.offsets[polygon]:self.offsets[polygon + 1]]
+            within = tested[point_in_edges(lons[tested], lats[tested], edges)]
+            result[within] = self.codes[polygon]
+            resolved[within] = True
+        return result
+
+    def code(self, lat, lon):
+        """
+        IRIS code of a location, as the complete_code of PYRIS
+        :return: a string, None if the location is outside of every contour
+        """
+        return self.lookup([lat], [lon])[0]
+
+
+def load_resolver(path=IRIS_PATH):
+    """
+    Converted IRIS contours
+    :return: an IrisResolver, None if the contours were not converted
+    """
+    if not os.path.exists(path):
+        return None
+    return IrisResolver.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conversion des contours IRIS pour la résolution locale')
+    parser.add_argument('source', help='fichier GeoJSON des contours IRIS (WGS84)')
+    parser.add_argument('--dep', type=int, action='append',
+                        help='département à conserver (par défaut ceux des villes)')
+    args = parser.parse_args()
+
+    departments = args.dep or [CITIES[city]['dep'] for city in CITIES]
+    resolver = IrisResolver.from_geojson(args.source, departments)
+    resolver.save()
+    print(f'{len(resolver)} contours IRIS, {len(resolver.edges)} arêtes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+# TEST DE CHARGE #
+#
+# Rejoue des sessions d'utilisateurs de l'application, en parallèle, sur les mêmes objets partagés que
+# locannuaire.py (moteur de calcul, index des rues, cache des cartes, client Pappers) : chaque session choisit
+# une ville, saisit une rue (suggestions à chaque étape de la saisie), lance la recherche et affiche ou non
+# la carte et le propriétaire. Comme Streamlit, un processus sert toutes ses sessions dans des threads ;
+# --processes lance plusieurs processus (plusieurs instances de l'application).
+# Les API sont remplacées par le serveur local du banc d'essai, avec une latence réglable ; le géocodage et
+# PYRIS y sont simulés à partir des commerces de la ville et des IRIS de la table INSEE.
+# Résultat : débit, percentiles p50/p95/p99 de chaque étape, mémoire de chaque processus, et contrôle que
+# les tables partagées n'ont pas été modifiées par les sessions.
+#
+#   python loadtest.py --sessions 100 --concurrency 16 --latency 0.08
+#   python loadtest.py --processes 2 --map-rate 1 --owner-rate 0.5 --json charge.json
+
+import argparse
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import datastore
+import metrics
+from benchmark import available, load_fixtures, offline_load, standin_http, start_standin
+from config import CITIES, INSEE
+from density import load_density
+from grid import load_grid
+from maps import MAP_RADIUS, render_map
+from owners import DENOMINATION, SIREN, OwnerClient
+from response_cache import ResponseCache
+from scoring import ScoringEngine
+from street_index import StreetSuggester
+
+NUMBER = 'N° voirie (Adresse du local)'
+PERCENTILES = [50, 95, 99]
+
+
+# SERVICES SIMULÉS #
+
+def pick(values, text):
+    """
+    Deterministic choice of a value for a text
+    """
+    digest = hashlib.sha256(text.encode()).digest()
+    return values[int.from_bytes(digest[:4], 'big') % len(values)]
+
+
+class FakeServices:
+    """
+    Answers of the API Adresse and PYRIS for any address: a shop of the city and an IRIS of its commune
+    """
+
+    def __init__(self, cities):
+        self.points, self.irises, self.centres = {}, {}, {}
+        insee = offline_load(INSEE)['IRIS'].astype(str)
+        for city in cities:
+            shops = offline_load(CITIES[city]['banco']).dropna(subset=['Y', 'X'])
+            self.points[city] = list(zip(shops['Y'].astype(float), shops['X'].astype(float)))
+            self.centres[city] = (float(shops['Y'].mean()), float(shops['X'].mean()))
+            codes = insee[insee.str.startswith(f"{CITIES[city]['dep']:02d}")].tolist()
+            self.irises[city] = codes or insee.tolist()
+
+    def adresse(self, path, params):
+        query = params.get('q', '')
+        city = next((city for city in self.points if query.upper().endswith(city.upper())), None)
+        if city is None:
+            return {'features': []}
+        lat, lon = pick(self.points[city], query)
+        return {'features': [{'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                              'properties': {'label': f'{query.title()} (simulé)'}}]}
+
+    def pyris(self, path, params):
+        lat, lon = float(params['lat']), float(params['lon'])
+        city = min(self.centres, key=lambda name: (self.centres[name][0] - lat) ** 2
+                                                  + (self.centres[name][1] - lon) ** 2)
+        return {'complete_code': pick(self.irises[city], f'{lat:.5f},{lon:.5f}')}
+
+    def handlers(self):
+        return {'api-adresse.data.gouv.fr': self.adresse, 'pyris.datajazz.io': self.pyris}
+
+
+# SESSIONS #
+
+def session_plan(flpm, city, rng, options):
+    """
+    Scenario of a session
+    :param flpm: FLPM dataframe of the city
+    :return: a dict {city, numb, street, prefixes (successive inputs), exact, map, owner}
+    """
+    row = flpm.iloc[int(rng.integers(len(flpm)))]
+    street = str(row['Adresse'])
+    numb = pd.to_numeric(row[NUMBER], errors='coerce')
+    typed = street.lower()
+    return {'city': city, 'numb': int(numb) if np.isfinite(numb) else 1, 'street': street,
+            'prefixes': [typed[:length] for length in (3, len(typed) // 2, len(typed)) if length > 0],
+            'exact': rng.random() < options['exact_rate'], 'map': rng.random() < options['map_rate'],
+            'owner': rng.random() < options['owner_rate']}
+
+
+class App:
+    """
+    Objects shared by the sessions of a process, as the st.cache functions of locannuaire build them
+    """
+
+    def __init__(self, base, store):
+        self.engine = ScoringEngine(load=offline_load,
+                                    http=standin_http(base, cache=ResponseCache(os.path.join(store, 'http.sqlite'))))
+        self.owners = OwnerClient(self.engine.http, path=os.path.join(store, 'owners.sqlite'))
+        self.suggester = StreetSuggester(maxsize=4096, limit=10)
+        self.grid = functools.lru_cache(maxsize=None)(load_grid)
+        self.density = functools.lru_cache(maxsize=None)(load_density)
+
+    def run(self, plan, think=0.0):
+        """
+        Replays a session, one trace per step (saisie, recherche)
+        :return: a list of spans
+        """
+        engine, city = self.engine, plan['city']
+        features = ['adresse', 'indice'] + ['carte'] * plan['map'] + ['proprietaire'] * plan['owner']
+        engine.warm_up(city, features)
+        spans = []
+
+        # saisie : l'application se réexécute à chaque validation du champ
+        street = plan['street']
+        with metrics.trace(city=city, step='saisie') as trace, metrics.span('saisie'):
+            index = engine.streets(city)
+            for prefix in plan['prefixes']:
+                match = index.search(prefix, min_score=80)
+                if not match:
+                    self.suggester.suggest(city, index, prefix)
+                time.sleep(think)
+            if match:
+                street = max(match, key=match.get)
+        spans += trace.table()
+
+        with metrics.trace(city=city, step='recherche') as trace, metrics.span('recherche'):
+            location = engine.locate(plan['numb'], street, city)
+            if location is not None:
+                with metrics.span('indice'):
+                    score = None
+                    transports = engine.transports(city, location['lat'], location['lon'])
+                    grid = None if plan['exact'] else self.grid(city)
+                    if grid is not None:
+                        score = grid.score(location, engine.insee().loc[int(location['code_iris'])], transports)
+                    if score is None:
+                        engine.score(location, transports=transports)
+                if plan['map']:
+                    with metrics.span('cartographie'):
+                        shops, shops_index = engine.banco(city)
+                        render_map(city, datastore.version(CITIES[city]['banco']), shops, shops_index,
+                                   (location['lat'], location['lon']), MAP_RADIUS, surface=self.grid(city),
+                                   density=self.density(city))
+                if plan['owner']:
+                    with metrics.span('proprietaire'):
+                        flpm = engine.flpm(city)
+                        rows = flpm[(flpm['Adresse'] == street) & (flpm[NUMBER] == str(plan['numb']))]
+                        if len(rows) > 0:
+                            siren = self.owners.owner_siren(rows[SIREN].iloc[0], rows[DENOMINATION].iloc[0])
+                            if siren is not None:
+                                self.owners.company(siren)
+        spans += trace.table()
+        return spans
+
+
+# MESURES #
+
+def rss_mb():
+    """
+    Resident memory of the process, in MB
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024     # maximum, en ko sous Linux
+
+
+def fingerprint(engine):
+    """
+    Hash of every dataset loaded by the engine, to detect the sessions modifying shared frames
+    :return: a dict {key: hash}
+    """
+    with engine.lock:
+        memo = dict(engine.memo)
+    prints = {}
+    for key, value in memo.items():
+        frames = value if isinstance(value, tuple) else (value,)
+        for number, frame in enumerate(frames):
+            if isinstance(frame, pd.DataFrame):
+                prints[f'{key}[{number}]'] = int(pd.util.hash_pandas_object(frame, index=True).sum())
+    return prints
+
+
+def run_process(base, plans, concurrency, think):
+    """
+    Sessions of one process (one instance of the application)
+    :return: a dict {spans, errors, rss, mutated, elapsed}
+    """
+    with tempfile.TemporaryDirectory() as store:
+        rss = {'start': rss_mb()}
+        app = App(base, store)
+        errors = []
+
+        def session(plan):
+            try:
+                return app.run(plan, think)
+            except Exception as error:       # une session en erreur ne doit pas arrêter le test
+                errors.append(f'{plan["city"]} {plan["numb"]} {plan["street"]}: {type(error).__name__} {error}')
+                return []
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            first = concurrency if len(plans) > concurrency else len(plans)
+            spans = [span for result in pool.map(session, plans[:first]) for span in result]
+            rss['warm'] = rss_mb()
+            before = fingerprint(app.engine)
+            spans += [span for result in pool.map(session, plans[first:]) for span in result]
+        elapsed = time.perf_counter() - start
+        rss['end'] = rss_mb()
+        after = fingerprint(app.engine)
+        mutated = sorted(key for key in before if after.get(key) != before[key])
+        return {'spans': spans, 'errors': errors, 'rss': rss, 'mutated': mutated, 'elapsed': elapsed,
+                'sessions': len(plans), 'pid': os.getpid()}
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=float)
+    return {f'p{p}': round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+
+
+def report(results, elapsed):
+    """
+    Aggregated results of every process
+    :return: a dict {sessions, errors, throughput, stages, processes}
+    """
+    by_stage = {}
+    for result in results:
+        for span in result['spans']:
+            by_stage.setdefault(span['stage'], []).append(span['ms'])
+    sessions = sum(result['sessions'] for result in results)
+    return {
+        'sessions': sessions,
+        'errors': sum(len(result['errors']) for result in results),
+        'elapsed_s': round(elapsed, 2),
+        'throughput': round(sessions / elapsed, 2) if elapsed else None,
+        'stages': {stage: {'count': len(values), **percentiles(values)}
+                   for stage, values in sorted(by_stage.items(), key=lambda item: -np.median(item[1]))},
+        'processes': [{'pid': result['pid'], 'sessions': result['sessions'],
+                       'rss_mb': {name: round(value, 1) for name, value in result['rss'].items()},
+                       'growth_mb': round(result['rss']['end'] - result['rss']['warm'], 1),
+                       'mutated': result['mutated'], 'errors': result['errors'][:5]} for result in results],
+    }
+
+
+def print_report(summary):
+    print(f"{summary['sessions']} sessions en {summary['elapsed_s']} s : {summary['throughput']} sessions/s, "
+          f"{summary['errors']} en erreur")
+    print(f"{'étape':<24}{'n':>7}" + ''.join(f'{f"p{p} (ms)":>12}' for p in PERCENTILES))
+    for stage, values in summary['stages'].items():
+        print(f'{stage:<24}{values["count"]:>7}' + ''.join(f'{values[f"p{p}"]:>12}' for p in PERCENTILES))
+    for process in summary['processes']:
+        rss = process['rss_mb']
+        print(f"processus {process['pid']} : {rss['start']} Mo au départ, {rss['warm']} Mo après les premières "
+              f"sessions, {rss['end']} Mo à la fin (+{process['growth_mb']} Mo)")
+        print(f"  tables partagées modifiées : {', '.join(process['mutated']) or 'aucune'}")
+        for error in process['errors']:
+            print(f'  erreur : {error}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'application (sessions simulées)")
+    parser.add_argument('--sessions', type=int, default=50, help='nombre de sessions par processus')
+    parser.add_argument('--concurrency', type=int, default=8, help='sessions simultanées par processus')
+    parser.add_argument('--processes', type=int, default=1, help="processus (instances de l'application)")
+    parser.add_argument('--latency', type=float, default=0.05, help='latence des API simulées, en secondes')
+    parser.add_argument('--think', type=float, default=0.0, help='pause entre deux saisies, en secondes')
+    parser.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    parser.add_argument('--map-rate', type=float, default=0.7, help='part des sessions affichant la carte')
+    parser.add_argument('--owner-rate', type=float, default=0.5, help='part des sessions cherchant le propriétaire')
+    parser.add_argument('--exact-rate', type=float, default=0.2, help="part des sessions en calcul exact de l'indice")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='fichier où écrire le résultat')
+    args = parser.parse_args()
+
+    cities = [city for city in args.city or list(CITIES) if available(CITIES[city]['flpm'])]
+    if not cities:
+        parser.error('aucune ville avec un fichier FLPM dans le dossier Data')
+    options = {'map_rate': args.map_rate, 'owner_rate': args.owner_rate, 'exact_rate': args.exact_rate}
+    rng = np.random.default_rng(args.seed)
+    flpm = {city: offline_load(CITIES[city]['flpm']) for city in cities}
+    plans = [[session_plan(flpm[city], city, rng, options)
+              for city in map(str, rng.choice(cities, args.sessions))] for _ in range(args.processes)]
+    del flpm
+
+    server, base = start_standin(load_fixtures(), latency=args.latency, handlers=FakeServices(cities).handlers())
+    try:
+        start = time.perf_counter()
+        if args.processes == 1:
+            results = [run_process(base, plans[0], args.concurrency, args.think)]
+        else:
+            with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+                results = list(pool.map(run_process, [base] * args.processes, plans,
+                                        [args.concurrency] * args.processes, [args.think] * args.processes))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    summary = report(results, elapsed)
+    print_report(summary)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=1)
+
+
+if __name__ == '__main__':
+    main()
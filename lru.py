@@ -0,0 +1,85 @@
+# CACHE LRU EN MÉMOIRE #
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """
+    Bounded mapping which evicts the least recently used entries, shared between sessions (thread safe)
+    """
+
+    def __init__(self, maxsize=1024, maxweight=None, weigher=len):
+        """
+        :param maxsize: maximum number of entries
+        :param maxweight: maximum total weight of the values (no limit by default)
+        :param weigher: weight of a value, by default its length (characters of a rendered page)
+        """
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigher = weigher
+        self.weight = 0
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """
+        Value of a key, marked as recently used
+        :param key: a hashable key
+        :param default: returned if the key is absent
+        :return: the cached value or default
+        """
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Value of a key, without changing its recency nor the counters
+        """
+        with self.lock:
+            return self.data.get(key, default)
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the oldest entries beyond maxsize
+        """
+        with self.lock:
+            if self.maxweight is not None:
+                if key in self.data:
+                    self.weight -= self.weigher(self.data[key])
+                self.weight += self.weigher(value)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight
+                                                    and len(self.data) > 1):
+                _, evicted = self.data.popitem(last=False)
+                if self.maxweight is not None:
+                    self.weight -= self.weigher(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.weight = 0
+
+    def stats(self):
+        """
+        Counters of the cache
+        :return: a dict
+        """
+        return {'size': len(self.data), 'maxsize': self.maxsize, 'weight': self.weight, 'maxweight': self.maxweight,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,248 @@
+# CARTOGRAPHIE #
+#
+# Construction de la carte du quartier. Les commerces sont limités à un rayon autour de l'adresse et
+# envoyés au navigateur sous forme de tableaux compacts : un calque FastMarkerCluster par catégorie
+# (chaque commerce une seule fois, l'icône est créée côté navigateur), que le contrôle des calques
+# permet d'afficher ou de masquer.
+# Les cartes rendues (HTML) sont gardées en mémoire, partagées entre les sessions, par ville, version des
+# données et coordonnées arrondies à quelques mètres.
+# folium n'est importé qu'à la construction de la première carte (près d'une seconde au démarrage sinon).
+
+import json
+from html import escape
+
+import numpy as np
+
+import metrics
+from lru import LRUCache
+
+MAP_RADIUS = 1000       # rayon par défaut des commerces affichés, en mètres (None : toute la ville)
+COORD_STEP = 5e-5       # pas d'arrondi des coordonnées de la clé du cache (environ 5m)
+COMPARE_RADIUS = 200   # rayon des commerces affichés autour de chaque adresse comparée
+MAP_CACHE = LRUCache(maxsize=256, maxweight=64 * 2 ** 20)     # 64 Mo de HTML au plus
+
+# type BANCO -> (nom du calque, icône Font Awesome)
+CATEGORIES = {
+    'restaurant': ('restaurant', 'fa-cutlery'),
+    'clothes': ('Vetements', 'fa-black-tie'),
+    'beauty': ('Beauté', 'fa-scissors'),
+    'bar': ('Bar', 'fa-beer'),
+    'bakery': ('Boulangerie', 'fa-bold'),
+    'cafe': ('Café', 'fa-coffee'),
+    'bank': ('Banques', 'fa-bank'),
+    'pharmacy': ('pharmacie', 'fa-plus'),
+    'convenience': ('commodité', 'fa-shopping-basket'),
+    'supermarket': ('Supermarché', 'fa-shopping-bag'),
+    'optician': ('Opticien', 'fa-eye'),
+    'florist': ('Fleuriste', 'fa-leaf'),
+    'jewelry': ('Bijouterie', 'fa-diamond'),
+    'department_store': ('Centre commercial', 'fa-cart-plus'),
+}
+ICON_COLOR = 'cadetblue'
+
+# création d'un marqueur à partir d'une ligne [lat, lon, nom] (le nom est affiché comme texte)
+MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: %s, prefix: 'fa', markerColor: %s});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    var popup = document.createElement('div');
+    popup.textContent = row[2];
+    marker.bindPopup(popup);
+    return marker;
+}
+"""
+
+
+def shops_around(shops, index, coord, radius=MAP_RADIUS):
+    """
+    Shops displayed on the map
+    :param shops: dataframe with BANCO data
+    :param index: GridIndex of the shops
+    :param coord: a tuple of geographic coordinates (lat, lon)
+    :param radius: radius in meters, None for the whole city
+    :return: a dataframe
+    """
+    if radius is None:
+        return shops
+    near, _ = index.query_radius(coord, radius)
+    return shops.iloc[near]
+
+
+def add_shop_layers(m, df):
+    """
+    One layer per category of shops, the coordinates rounded to the meter
+    :param m: a folium map
+    :param df: dataframe with BANCO data
+    :return: the located shops (columns Y, X, name, type)
+    """
+    from folium import plugins
+
+    points = df[['Y', 'X', 'name', 'type']].dropna(subset=['Y', 'X'])
+    for shop_type, (label, icon) in CATEGORIES.items():
+        selected = points[points['type'] == shop_type]
+        if len(selected) == 0:
+            continue
+        data = [[round(float(lat), 5), round(float(lon), 5), str(name)]
+                for lat, lon, name in zip(selected['Y'], selected['X'], selected['name'].astype(object).fillna(''))]
+        plugins.FastMarkerCluster(data, callback=MARKER_CALLBACK % (json.dumps(icon), json.dumps(ICON_COLOR)),
+                                  name=label).add_to(m)
+    return points
+
+
+def carte(df, coord, surface=None, density=None, radius=MAP_RADIUS):
+    """
+    Builder of the cartography
+    :param df: dataframe with BANCO data (see shops_around)
+    :param coord: a tuple of geographic coordinates (lat, lon)
+    :param surface: optional CityGrid, its notes are displayed as a layer
+    :param density: optional DensityRaster, displayed instead of the heatmap of the shops
+    :param radius: extent of the density images around the location, in meters
+    :return: a folium map
+    """
+    import folium
+    from folium import plugins
+
+    m = folium.Map(location=coord, zoom_start=16)
+
+    marker_adresse = folium.Marker(location=coord)
+    marker_adresse.add_to(m)
+
+    points = add_shop_layers(m, df)
+
+    # La densité : images précalculées si elles existent, sinon heatmap calculée par le navigateur
+    if density is not None:
+        for number, category in enumerate(density.names):
+            overlay = density.overlay(category, coord, radius or MAP_RADIUS)
+            if overlay is None:
+                continue
+            name = 'Densité des commerces' if number == 0 else f'Densité : {CATEGORIES[category][0]}'
+            folium.raster_layers.ImageOverlay(overlay[0], overlay[1], name=name, show=number == 0).add_to(m)
+    else:
+        heat = points[['Y', 'X']].round(5).to_numpy().tolist()
+        plugins.HeatMap(heat, min_opacity=0.4, name='Densité des commerces').add_to(m)
+
+    minimap = plugins.MiniMap()
+    m.add_child(minimap)
+
+    plugins.LocateControl(strings={"title": "Localisez-moi"}).add_to(m)
+
+    plugins.Fullscreen(
+        position="topleft",
+        title="Plein écran",
+        title_cancel="Quitter",
+        force_separate_button=True,
+    ).add_to(m)
+
+    plugins.SemiCircle(
+        coord,
+        radius=400,
+        direction=360,
+        arc=359.99,
+        color="red",
+        fill_color="red",
+        opacity=0,
+    ).add_to(m)
+
+    plugins.SemiCircle(
+        coord,
+        radius=200,
+        direction=360,
+        arc=359.99,
+        color="red",
+        fill_color="red",
+        opacity=0,
+    ).add_to(m)
+
+    plugins.Geocoder(position="bottomleft").add_to(m)
+
+    if surface is not None:
+        image, bounds = surface.overlay()
+        folium.raster_layers.ImageOverlay(image, bounds, name="Indice d'attractivité (grille)",
+                                          opacity=0.5, show=False).add_to(m)
+
+    folium.LayerControl(collapsed=True).add_to(m)
+
+    return m
+
+
+def map_key(city, version, coord, radius=MAP_RADIUS, surface=None, density=None, step=COORD_STEP):
+    """
+    Key of a rendered map: two searches a few meters apart give the same map
+    :param version: version of the shops dataset
+    :param surface: optional CityGrid displayed on the map
+    :param density: optional DensityRaster displayed on the map
+    :return: a tuple
+    """
+    return (city, version, round(coord[0] / step), round(coord[1] / step), radius,
+            None if surface is None else surface.version, None if density is None else density.version)
+
+
+def render_map(city, version, shops, index, coord, radius=MAP_RADIUS, surface=None, density=None,
+               cache=MAP_CACHE):
+    """
+    HTML of the map of a location, rendered once per key (see map_key)
+    :param shops: dataframe with BANCO data of the city
+    :param index: GridIndex of the shops
+    :param radius: radius of the shops displayed, None for the whole city
+    :return: a string (full HTML page)
+    """
+    key = map_key(city, version, coord, radius, surface, density)
+    html = cache.get(key)
+    metrics.count('map_cache', result='miss' if html is None else 'hit')
+    if html is None:
+        with metrics.span('carte', city=city):
+            m = carte(shops_around(shops, index, coord, radius), coord, surface=surface, density=density,
+                      radius=radius)
+            from folium import Figure
+            html = Figure().add_child(m).render()
+        metrics.count('map_bytes', len(html))
+        cache.put(key, html)
+    return html
+
+
+def note_color(note):
+    """
+    Color of a marker of the comparison map, from the attractiveness index (same steps as the application)
+    """
+    if note >= 75:
+        return 'green'
+    elif note >= 60:
+        return 'orange'
+    elif note >= 50:
+        return 'lightred'
+    return 'red'
+
+
+def compare_map(table, shops, index, radius=COMPARE_RADIUS):
+    """
+    Map of the compared addresses: one numbered marker per address, colored by its index,
+    and the shops around all of them
+    :param table: ranked dataframe returned by compare.compare (columns rang, adresse, lat, lon, total)
+    :param shops: dataframe with BANCO data of the city
+    :param index: GridIndex of the shops
+    :param radius: radius of the shops displayed around each address, in meters
+    :return: a string (full HTML page)
+    """
+    import folium
+
+    located = table.dropna(subset=['lat', 'lon', 'total'])
+    points = list(zip(located['lat'].astype(float), located['lon'].astype(float)))
+    m = folium.Map(location=points[0] if points else None, zoom_start=15)
+
+    # commerces autour de l'ensemble des adresses, chacun une seule fois
+    near = [index.query_radius(point, radius)[0] for point in set(points)]
+    if near:
+        add_shop_layers(m, shops.iloc[np.unique(np.concatenate(near))])
+
+    addresses = folium.FeatureGroup(name='Adresses comparées')
+    for row, point in zip(located.itertuples(), points):
+        text = escape(f'{row.rang} - {row.adresse} : {row.total} / 100')    # adresse issue de la saisie
+        folium.Marker(point, tooltip=text, popup=folium.Popup(text, max_width=300),
+                      icon=folium.Icon(color=note_color(row.total), icon='info-sign')).add_to(addresses)
+    addresses.add_to(m)
+
+    if len(points) > 1:
+        lats, lons = zip(*points)
+        m.fit_bounds([[min(lats), min(lons)], [max(lats), max(lons)]])
+    folium.LayerControl(collapsed=True).add_to(m)
+    return folium.Figure().add_child(m).render()
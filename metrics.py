@@ -0,0 +1,274 @@
+# MESURES DE PERFORMANCE #
+#
+# Durée de chaque étape d'une recherche (géocodage, IRIS, transports, BANCO, parkings, BPE, notes, carte,
+# Pappers...), compteurs (succès des caches, volumes reçus) et état des caches. Trois sorties :
+#   - la trace de la recherche en cours, affichée par le panneau de debug de l'application ;
+#   - des logs structurés, une ligne JSON par étape (logger 'popmydata') ;
+#   - un point de collecte au format texte de Prometheus (GET /metrics), démarré par l'application
+#     si config.METRICS_PORT est indiqué, sur la boucle locale par défaut (config.METRICS_HOST).
+
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGGER = logging.getLogger('popmydata')
+PREFIX = 'popmydata'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)     # secondes
+CURRENT = contextvars.ContextVar('trace', default=None)
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    escape = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+    return '{' + ','.join(f'{name}="{str(value).translate(escape)}"' for name, value in sorted(labels)) + '}'
+
+
+def value_text(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Registry:
+    """
+    Counters and histograms of the process, shared by every session (thread safe)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.collectors = {}
+
+    def count(self, name, value=1, **labels):
+        """
+        Adds a value to a counter
+        :param name: name of the counter, without prefix nor _total suffix
+        :param labels: labels of the counter (few distinct values: host, cache, result...)
+        """
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds a duration (or any value) to a histogram
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * len(self.buckets) + [0, 0.0])
+            for number, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[number] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def register(self, name, collect):
+        """
+        Gauges read at each collection
+        :param name: prefix of the gauges
+        :param collect: function returning a dict {gauge: number}, e.g. the stats of a cache
+        """
+        with self.lock:
+            self.collectors[name] = collect
+
+    def gauges(self):
+        with self.lock:
+            collectors = dict(self.collectors)
+        values = {}
+        for name, collect in collectors.items():
+            try:
+                stats = collect()
+            except Exception:       # une source indisponible ne doit pas bloquer la collecte
+                LOGGER.exception('collecte %s', name)
+                continue
+            for gauge, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[f'{name}_{gauge}'] = value
+        return values
+
+    def snapshot(self):
+        """
+        Current values, for the debug panel
+        :return: a dict {counters, stages: {stage: {count, total, mean}}, gauges}
+        """
+        with self.lock:
+            counters = {name + label_text(labels): value for (name, labels), value in self.counters.items()}
+            stages = {dict(labels).get('stage', name): {'count': h[-2], 'total': round(h[-1], 3),
+                                                         'mean': round(h[-1] / h[-2], 3) if h[-2] else 0}
+                      for (name, labels), h in self.histograms.items() if name == 'stage_seconds'}
+        return {'counters': counters, 'stages': stages, 'gauges': self.gauges()}
+
+    def render(self):
+        """
+        Text format of Prometheus
+        :return: a string
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            lines += [f'{PREFIX}_{name}_total{label_text(labels)} {value_text(value)}'
+                      for (other, labels), value in counters if other == name]
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f'# TYPE {PREFIX}_{name} histogram')
+            for (other, labels), histogram in histograms:
+                if other != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'{PREFIX}_{name}_bucket{label_text(labels + (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{PREFIX}_{name}_bucket{label_text(labels + (("le", "+Inf"),))} {histogram[-2]}')
+                lines.append(f'{PREFIX}_{name}_count{label_text(labels)} {histogram[-2]}')
+                lines.append(f'{PREFIX}_{name}_sum{label_text(labels)} {value_text(histogram[-1])}')
+        for gauge, value in sorted(self.gauges().items()):
+            lines.append(f'# TYPE {PREFIX}_{gauge} gauge')
+            lines.append(f'{PREFIX}_{gauge} {value_text(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+REGISTRY = Registry()
+
+
+def count(name, value=1, **labels):
+    REGISTRY.count(name, value, **labels)
+
+
+class Trace:
+    """
+    Spans of one search, in the order they ended
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.spans = []
+
+    def add(self, stage, start, elapsed, labels, error):
+        self.spans.append({'stage': stage, 'start_ms': round((start - self.start) * 1000, 1),
+                           'ms': round(elapsed * 1000, 1), 'error': error, **labels})
+
+    def table(self):
+        """
+        :return: list of dicts {stage, start_ms, ms, error, labels...} sorted by start
+        """
+        return sorted(self.spans, key=lambda span: span['start_ms'])
+
+
+@contextmanager
+def trace(**labels):
+    """
+    Collects the spans of a search (including those of the threads started with propagate)
+    :param labels: written in the log of the search, e.g. the city
+    :return: a Trace
+    """
+    current = Trace(**labels)
+    token = CURRENT.set(current)
+    try:
+        yield current
+    finally:
+        CURRENT.reset(token)
+        current.elapsed = time.perf_counter() - current.start
+        LOGGER.info(json.dumps({'event': 'search', 'ms': round(current.elapsed * 1000, 1), 'spans': len(current.spans),
+                                **labels}, default=str))
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Times a stage: histogram stage_seconds{stage}, a line of log, and the current trace if any
+    :param stage: name of the stage
+    :param labels: details written in the log and the trace only (not in the metrics)
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REGISTRY.observe('stage_seconds', elapsed, stage=stage)
+        if error is not None:
+            REGISTRY.count('stage_errors', stage=stage)
+        current = CURRENT.get()
+        if current is not None:
+            current.add(stage, start, elapsed, labels, error)
+        LOGGER.info(json.dumps({'event': 'span', 'stage': stage, 'ms': round(elapsed * 1000, 1),
+                                'error': error, **labels}, default=str))
+
+
+def timed(stage):
+    """
+    Decorator timing every call of a function as a stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(function):
+    """
+    Function running in the context of the caller: its spans go to the current trace when run in a pool
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, registry=REGISTRY, host='127.0.0.1'):
+    """
+    Starts the collection endpoint (GET /metrics) in a background thread
+    :param port: port to listen to (0: any free port)
+    :param host: interface to listen on, the loopback by default ('0.0.0.0': every interface)
+    :return: the server, server.shutdown() stops it
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_logging(level=logging.INFO):
+    """
+    Structured logs of the metrics on the standard error, one JSON object per line
+    """
+    if not LOGGER.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        LOGGER.addHandler(handler)
+        LOGGER.propagate = False
+    LOGGER.setLevel(level)
@@ -0,0 +1,240 @@
+# RECHERCHE DES PROPRIÉTAIRES (PAPPERS) #
+#
+# Client dédié à l'API Pappers : les fiches des entreprises sont conservées par SIREN (et les recherches
+# par dénomination) dans une base SQLite partagée entre les sessions, une même fiche n'est demandée qu'une
+# fois même si plusieurs sessions la réclament en même temps, et les appels simultanés respectent un débit
+# maximum (config.PAPPERS_RATE).
+
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import pandas as pd
+
+import datastore
+import metrics
+from config import PAPPERS_RATE, PAPPERS_TTL, pappers_enterprise, pappers_key, pappers_reaserch
+
+OWNERS_PATH = os.path.join(datastore.STORE_DIR, 'owners.sqlite')
+OWNERS_TTL = PAPPERS_TTL
+
+SIREN = 'N° SIREN (Propriétaire(s) du local)'
+DENOMINATION = 'Dénomination (Propriétaire(s) du local)'
+NUMBER = 'N° voirie (Adresse du local)'
+
+
+def clean_soc_name(soc_name):
+    """
+    Cleans up company names for search in PAPPERS
+    :param soc_name: (string) A name of à company
+    :return: a string
+    """
+    ban_words = ['SA', 'SOCIETE', 'CIVILE', 'IMMOBILIERE']
+    search_name = [word for word in soc_name.split() if word not in ban_words]
+    return ' '.join(search_name)
+
+
+def valid_siren(siren):
+    """
+    SIREN of the FLPM files, the fictitious ones start with 'U'
+    :return: the SIREN as a string, None if it is missing or fictitious
+    """
+    if siren is None or pd.isna(siren):
+        return None
+    siren = str(siren).strip()
+    return None if not siren or siren.startswith('U') else siren
+
+
+class RateLimiter:
+    """
+    Spaces the calls so that there are at most rate calls per second (thread safe)
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OwnerClient:
+    """
+    Company records of Pappers, cached by SIREN, with deduplication of the requests in progress
+    """
+
+    def __init__(self, http, path=OWNERS_PATH, ttl=OWNERS_TTL, rate=PAPPERS_RATE, workers=4):
+        """
+        :param http: an HttpClient
+        :param path: SQLite file of the records (':memory:' for a cache limited to the process)
+        :param ttl: validity of the records in seconds
+        :param rate: maximum number of requests per second to Pappers
+        :param workers: maximum number of simultaneous requests
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.http = http
+        self.ttl = ttl
+        self.limiter = RateLimiter(rate)
+        self.pool = ThreadPoolExecutor(workers)
+        self.lock = Lock()
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # companies : SIREN -> fiche (json), names : dénomination recherchée -> SIREN ('' si inconnue)
+        for table in ('companies', 'names'):
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, '
+                                    'fetched REAL)')
+
+    # CACHE #
+
+    def stored(self, table, key):
+        """
+        Value stored for a key, None if it is absent or expired
+        """
+        with self.lock:
+            row = self.connection.execute(f'SELECT value, fetched FROM {table} WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return row
+
+    def count(self, hit):
+        with self.lock:     # appelé depuis les threads du pool et des sessions
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def store(self, table, key, value):
+        with self.lock:
+            self.connection.execute(f'INSERT OR REPLACE INTO {table} VALUES (?, ?, ?)', (key, value, time.time()))
+
+    def single_flight(self, key, fetch):
+        """
+        Runs fetch once for all the callers asking for the same key at the same time
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = fetch()
+            future.set_result(result)
+            return result
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def get(self, url, params):
+        # attente du quota comprise dans la durée mesurée ; les appelants ont déjà cherché dans la base,
+        # le quota n'est donc consommé que par les vrais appels à Pappers
+        with metrics.span('pappers'):
+            self.limiter.wait()
+            return self.http.get(url, params={'api_token': pappers_key, **params}).json()
+
+    # RECHERCHES #
+
+    def company(self, siren):
+        """
+        Record of a company (siege, denomination, representants...)
+        :param siren: SIREN of the company
+        :return: a dict, None if Pappers does not know the SIREN
+        """
+        siren = str(siren)
+        row = self.stored('companies', siren)
+        self.count(row is not None)
+        if row is not None:
+            return json.loads(row[0])
+
+        def fetch():
+            row = self.stored('companies', siren)      # enregistrée entre-temps par un autre appel
+            if row is not None:
+                return json.loads(row[0])
+            record = self.get(pappers_enterprise, {'siren': siren})
+            if 'siege' not in record:
+                return None
+            self.store('companies', siren, json.dumps(record))
+            return record
+        return self.single_flight(('company', siren), fetch)
+
+    def companies(self, sirens):
+        """
+        Records of several companies, fetched at the same time within the rate limit
+        :param sirens: iterable of SIREN (duplicates are fetched once)
+        :return: a dict {siren: record or None}
+        """
+        unique = list(dict.fromkeys(str(siren) for siren in sirens))
+        futures = {siren: self.pool.submit(self.company, siren) for siren in unique}
+        return {siren: future.result() for siren, future in futures.items()}
+
+    def search_siren(self, name):
+        """
+        SIREN of the first company found by name
+        :param name: denomination of the owner in the FLPM file
+        :return: a string, None if no company was found
+        """
+        query = clean_soc_name(name)
+        row = self.stored('names', query)
+        self.count(row is not None)
+        if row is not None:
+            return row[0] or None
+
+        def fetch():
+            row = self.stored('names', query)
+            if row is not None:
+                return row[0] or None
+            found = self.get(pappers_reaserch, {'q': query})
+            siren = found['resultats'][0]['siren'] if found.get('total') else None
+            self.store('names', query, siren or '')
+            return siren
+        return self.single_flight(('name', query), fetch)
+
+    def owner_siren(self, siren, name):
+        """
+        SIREN of an owner of the FLPM file, searched by name when the SIREN is fictitious
+        :return: a string, None if the company could not be identified
+        """
+        return valid_siren(siren) or (self.search_siren(name) if isinstance(name, str) else None)
+
+    def street_owners(self, flpm, street):
+        """
+        Every owner of the premises of a street
+        :param flpm: FLPM dataframe of the city
+        :param street: street name as written in the column Adresse
+        :return: a dataframe (siren, denomination, numeros, ville du siege), one row per owner
+        """
+        rows = flpm[flpm['Adresse'] == street]
+        owners = rows.groupby([SIREN, DENOMINATION], dropna=False, observed=True)[NUMBER] \
+            .apply(lambda numbers: ', '.join(sorted({str(n) for n in numbers}, key=lambda n: (len(n), n)))) \
+            .reset_index()
+        sirens = list(self.pool.map(lambda owner: self.owner_siren(*owner),
+                                    zip(owners[SIREN], owners[DENOMINATION])))
+        records = self.companies(siren for siren in sirens if siren is not None)
+        return pd.DataFrame({
+            'SIREN': sirens,
+            'Dénomination': owners[DENOMINATION],
+            'Numéros': owners[NUMBER],
+            'Ville du siège': [(records.get(siren) or {}).get('siege', {}).get('ville') if siren else None
+                               for siren in sirens],
+        })
+
+    def stats(self):
+        with self.lock:
+            size = self.connection.execute('SELECT COUNT(*) FROM companies').fetchone()[0]
+            return {'companies': size, 'hits': self.hits, 'misses': self.misses}
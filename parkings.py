@@ -0,0 +1,76 @@
+# EXTRAITS DÉPARTEMENTAUX DES PARKINGS #
+#
+# La Base Nationale des Lieux de Stationnement (config.PARK) est lue une seule fois, par morceaux, et découpée
+# en un extrait par département dans le stockage colonnaire (coordonnées numériques, colonnes utiles
+# uniquement). L'application ne charge ensuite que l'extrait du département recherché.
+#
+#   python parkings.py              # départements de config.CITIES
+#   python parkings.py --dep 33
+
+import argparse
+
+import pandas as pd
+
+import datastore
+from config import CITIES, PARK
+
+PARK_COLUMNS = ['insee', 'Xlong', 'Ylat', 'nom', 'nb_places', 'gratuit', 'adresse']
+CHUNK_ROWS = 100000
+
+
+def extract_name(departement):
+    return f'parking_{departement}'
+
+
+def parking_source(departement, store=datastore.STORE_DIR):
+    """
+    Dataset to read for the parkings of a department
+    :return: the name of the extract if it was ingested, else the url of the national file
+    """
+    name = extract_name(departement)
+    return name if datastore.version(name, store) is not None else PARK
+
+
+def in_department(insee, departement):
+    """
+    Rows of the communes of a department
+    :param insee: series of INSEE codes of the communes
+    :return: boolean series
+    """
+    codes = insee.astype(str).str.replace(r'\.0$', '', regex=True).str.zfill(5)
+    return codes.str.startswith(f'{int(departement):02d}')
+
+
+def ingest(source=PARK, departments=None, store=datastore.STORE_DIR, chunk_rows=CHUNK_ROWS):
+    """
+    Splits the national parking file into one extract per department
+    :param source: path or url of the national csv file (separator ';')
+    :param departments: departments to extract (those of config.CITIES by default)
+    :return: a dict {department: entry of the manifest}
+    """
+    departments = departments or sorted({CITIES[city]['dep'] for city in CITIES})
+    parts = {dep: [] for dep in departments}
+    for chunk in pd.read_csv(source, sep=';', usecols=PARK_COLUMNS, chunksize=chunk_rows, low_memory=False):
+        for dep in departments:
+            parts[dep].append(chunk[in_department(chunk['insee'], dep)])
+
+    entries = {}
+    for dep, frames in parts.items():
+        frame = datastore.parse_coordinates(pd.concat(frames, ignore_index=True))
+        frame = frame.dropna(subset=['Xlong', 'Ylat'])
+        entries[dep] = datastore.write_dataset(frame, source, store=store, name=extract_name(dep))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extraits départementaux de la base nationale des parkings')
+    parser.add_argument('--source', default=PARK, help='fichier csv national (séparateur ;)')
+    parser.add_argument('--dep', type=int, action='append', help='département (par défaut ceux des villes)')
+    args = parser.parse_args()
+
+    for dep, entry in ingest(args.source, args.dep).items():
+        print(f"{extract_name(dep):<15} {entry['rows']:>6} parkings")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+# CLASSEMENT DES LOCAUX D'UNE VILLE #
+#
+# Notes de tous les locaux du fichier FLPM d'une ville (locaux commerciaux des personnes morales), calculées
+# une fois et enregistrées comme une table du stockage colonnaire (Data/store/ranking_<ville>.feather).
+# Les K meilleurs locaux, au total ou pour un sous-indice, sont ensuite lus dans la table avec un tas,
+# avec des filtres par rue, arrondissement ou forme juridique du propriétaire.
+# Calcul de la table : chaque adresse distincte est géocodée (index local des adresses, puis service csv de
+# l'API Adresse), son code IRIS lu dans les contours locaux (PYRIS sinon), puis les indicateurs de chaque
+# emplacement distinct sont comptés par paquets dans un pool de processus et notés en une passe.
+# Comme pour la grille, les transports interrogés en direct (bus, vélos, réseaux de Bordeaux et Lille)
+# ne sont pas pris en compte.
+#
+#   python ranking.py build --city Bordeaux --processes 4
+#   python ranking.py top --city Paris -k 20 --by visibilite --arrondissement 11 --forme SCI
+
+import argparse
+import hashlib
+import heapq
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import datastore
+import metrics
+from bulk_geocoding import BULK_API
+from config import CITIES, INSEE
+from geocoder import address_key
+from grid import PointIndicators, sources_version
+from http_client import HttpClient
+from indices import RULES, rate_locations
+from owners import DENOMINATION, SIREN
+from response_cache import ResponseCache
+from scoring import ScoringEngine
+
+NUMBER = 'N° voirie (Adresse du local)'
+REPETITION = 'Indice de répétition (Adresse du local)'
+COMMUNE = 'Code Commune (Champ géographique)'
+FORM = 'Forme juridique abrégée (Propriétaire(s) du local)'
+NOTES = ['total'] + list(RULES)         # total, visibilite, accessibilite, population, quartier
+CHUNK_SIZE = 500                        # emplacements par tâche du pool de processus
+WORKER = {}                             # données de chaque processus du pool (voir start_worker)
+
+
+def ranking_name(city):
+    return f'ranking_{city.lower()}'
+
+
+def ranking_path(city, store=datastore.STORE_DIR):
+    return os.path.join(store, f'{ranking_name(city)}.feather')
+
+
+def ranking_version(city):
+    """
+    Hash of the versions of the datasets used by the score table of a city
+    """
+    versions = [sources_version(city), str(datastore.version(CITIES[city]['flpm'])), str(datastore.version(INSEE))]
+    return hashlib.sha256('|'.join(versions).encode()).hexdigest()
+
+
+# CALCUL DE LA TABLE #
+
+def start_worker(load):
+    """
+    Initializer of the processes of the pool: each process reads its own datasets (memory mapped)
+    :param load: function (url, sep) -> dataframe used to read the datasets
+    """
+    WORKER['engine'] = ScoringEngine(load=load, warm_up_workers=1)
+    WORKER['indicators'] = {}
+
+
+def location_totals(city, lats, lons):
+    """
+    Indicator totals of many locations of a city (see grid.PointIndicators), run in the pool
+    :return: a tuple (names of the indicators, float32 array locations x indicators)
+    """
+    indicators = WORKER['indicators'].get(city)
+    if indicators is None:
+        indicators = WORKER['indicators'][city] = PointIndicators(WORKER['engine'], city)
+    totals = np.zeros((len(lats), len(indicators.names)), dtype=np.float32)
+    for number, point in enumerate(zip(lats, lons)):
+        indicators.values(point, out=totals[number])
+    return indicators.names, totals
+
+
+def count_indicators(city, lats, lons, processes=4, chunk_size=CHUNK_SIZE, load=datastore.read_dataset):
+    """
+    Indicator totals of every location, computed by chunks in a pool of processes
+    :param processes: number of processes (1: in the current process)
+    :return: a dataframe, one row per location and one column per indicator
+    """
+    chunks = [(lats[start:start + chunk_size], lons[start:start + chunk_size])
+              for start in range(0, len(lats), chunk_size)]
+    if processes == 1:
+        start_worker(load)
+        results = [location_totals(city, *chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=start_worker, initargs=(load,)) as pool:
+            results = list(pool.map(location_totals, [city] * len(chunks), *zip(*chunks)))
+    if not results:
+        return pd.DataFrame()
+    return pd.DataFrame(np.concatenate([totals for _, totals in results]), columns=results[0][0])
+
+
+def iris_codes(engine, lats, lons, workers=8):
+    """
+    IRIS codes of many locations: local contours, then PYRIS for the locations outside of them
+    :return: an object array of codes (None when unknown)
+    """
+    resolver = engine.iris()
+    codes = resolver.lookup(lats, lons) if resolver is not None else np.full(len(lats), None, dtype=object)
+    missing = [number for number, code in enumerate(codes) if code is None]
+
+    def remote(number):
+        try:
+            return engine.code_iris(lats[number], lons[number])
+        except Exception:           # un emplacement sans code IRIS est noté sans population
+            return None
+
+    with ThreadPoolExecutor(workers) as pool:
+        for number, code in zip(missing, pool.map(remote, missing)):
+            codes[number] = code
+    return codes
+
+
+def build_ranking(engine, city, processes=4, chunk_size=CHUNK_SIZE, load=datastore.read_dataset, url=BULK_API):
+    """
+    Notes of every premises of the FLPM file of a city
+    :param engine: a ScoringEngine (geocoding, IRIS and INSEE data)
+    :param city: name of the city
+    :param processes: processes counting the indicators
+    :param load: function (url, sep) -> dataframe used by the processes to read the datasets
+    :param url: url of the csv service of the API Adresse (a local stand-in server for the tests)
+    :return: a dataframe, one row per premises: local (row of the FLPM file), numero, repetition, rue,
+             commune, forme, denomination, siren, adresse, lat, lon, code_iris and the notes
+             (missing when the address was not found)
+    """
+    flpm = engine.flpm(city)
+    table = pd.DataFrame({'local': np.arange(len(flpm)),
+                          'numero': flpm[NUMBER].astype(object).to_numpy(),
+                          'repetition': flpm[REPETITION].astype(object).to_numpy(),
+                          'rue': flpm['Adresse'].astype(object).to_numpy(),
+                          'commune': flpm[COMMUNE].to_numpy(),
+                          'forme': flpm[FORM].astype(object).to_numpy(),
+                          'denomination': flpm[DENOMINATION].astype(object).to_numpy(),
+                          'siren': flpm[SIREN].astype(object).to_numpy()})
+
+    # une seule géolocalisation par adresse distincte (plusieurs locaux par adresse)
+    with metrics.span('geocodage classement', city=city):
+        keys = table[['numero', 'rue']].fillna('')
+        address_ids = keys.groupby(['numero', 'rue'], sort=False).ngroup().to_numpy()
+        addresses = keys.drop_duplicates()          # dans l'ordre des groupes (première apparition)
+        located = engine.geocode_many(list(zip(addresses['numero'], addresses['rue'], [city] * len(addresses))),
+                                      url=url)
+        table['adresse'] = np.array([location['label'] if location else None for location in located],
+                                    dtype=object)[address_ids]
+        table['lat'] = np.array([location['lat'] if location else np.nan for location in located])[address_ids]
+        table['lon'] = np.array([location['lon'] if location else np.nan for location in located])[address_ids]
+
+    # un seul calcul par emplacement distinct
+    point_ids = table.groupby(['lat', 'lon'], sort=False).ngroup().fillna(-1).to_numpy(dtype=np.int64)  # -1 : inconnue
+    points = table.loc[table['lat'].notna(), ['lat', 'lon']].drop_duplicates()
+    lats, lons = points['lat'].to_numpy(dtype=float), points['lon'].to_numpy(dtype=float)
+    with metrics.span('iris classement', city=city):
+        codes = iris_codes(engine, lats, lons)
+    with metrics.span('indicateurs classement', city=city, locations=len(points)):
+        totals = count_indicators(city, lats, lons, processes, chunk_size, load)
+
+    # population de l'IRIS de chaque emplacement, puis toutes les notes en une passe
+    insee = engine.insee()
+    rows = insee.reindex([int(code) if code is not None else -1 for code in codes])
+    totals['Population Active'] = rows['Population Active'].to_numpy(dtype=float)
+    totals['Revenu médian'] = rows['Revenus Medians'].to_numpy(dtype=float)
+    with metrics.span('notes classement', city=city):
+        notes = rate_locations(totals, CITIES[city]['dep'])
+
+    located = point_ids >= 0
+    table['code_iris'] = None
+    table.loc[located, 'code_iris'] = codes[point_ids[located]]
+    for note in NOTES:
+        values = np.full(len(table), np.nan)
+        values[located] = notes[note].to_numpy()[point_ids[located]]
+        table[note] = pd.array(values, dtype='Int16')
+    return table
+
+
+def save_ranking(table, city, store=datastore.STORE_DIR):
+    """
+    Stores the score table of a city in the store, with the version of its datasets
+    :return: the entry of the manifest
+    """
+    path = ranking_path(city, store)
+    entry = datastore.write_dataset(datastore.compact(table.copy()), path, store=store, name=ranking_name(city))
+    manifest = datastore.read_manifest(store)
+    manifest[ranking_name(city)]['version'] = entry['version'] = ranking_version(city)
+    datastore.write_manifest(manifest, store)
+    return entry
+
+
+def load_ranking(city, store=datastore.STORE_DIR):
+    """
+    Score table of a city
+    :return: a dataframe (see build_ranking), None if it was not computed or if its datasets changed since
+    """
+    entry = datastore.read_manifest(store).get(ranking_name(city))
+    if entry is None or entry.get('version') != ranking_version(city) or not os.path.exists(ranking_path(city, store)):
+        return None
+    return datastore.read_dataset(ranking_path(city, store), store=store)
+
+
+# REQUÊTES #
+
+def select(table, city, street=None, arrondissement=None, form=None):
+    """
+    Premises matching the filters
+    :param street: name of the street (accents, case and punctuation ignored)
+    :param arrondissement: number of the arrondissement (Paris) or code of the commune in the department
+    :param form: short legal form of the owner (SCI, SA, SAS...)
+    :return: a boolean array
+    """
+    mask = table['total'].notna().to_numpy()
+    if street:
+        streets = table['rue'].astype(object).fillna('').map(address_key)
+        mask &= (streets == address_key(street)).to_numpy()
+    if arrondissement is not None:
+        code = 100 + arrondissement if city == 'Paris' and arrondissement < 100 else arrondissement
+        mask &= (table['commune'].to_numpy() == code)
+    if form:
+        mask &= (table['forme'].astype(object).fillna('').str.upper() == form.upper()).to_numpy()
+    return mask
+
+
+def top_k(table, city, k=10, by='total', street=None, arrondissement=None, form=None, per_address=False):
+    """
+    The k best premises for a note, read in the score table with a heap (no full sort of the table)
+    :param by: 'total' or a sub-index (visibilite, accessibilite, population, quartier)
+    :param per_address: keeps only the first premises of each address
+    :return: a dataframe of at most k rows, best first (ties in the order of the FLPM file, then by total)
+    """
+    if by not in NOTES:
+        raise ValueError(f'note inconnue : {by} (valeurs possibles : {", ".join(NOTES)})')
+    candidates = np.flatnonzero(select(table, city, street, arrondissement, form))
+    if per_address:
+        keys = table[['numero', 'repetition', 'rue']].astype(object).fillna('').to_numpy()[candidates]
+        _, first = np.unique([' '.join(map(str, key)) for key in keys], return_index=True)
+        candidates = candidates[np.sort(first)]
+    values = table[by].to_numpy(dtype=float, na_value=np.nan)
+    totals = table['total'].to_numpy(dtype=float, na_value=np.nan)
+    best = heapq.nlargest(k, candidates, key=lambda row: (values[row], totals[row], -row))
+    return table.iloc[best].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classement des locaux commerciaux du fichier FLPM d\'une ville')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='calcule et enregistre la table des notes')
+    build.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    build.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='processus de calcul')
+    build.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='emplacements par tâche')
+    build.add_argument('--bulk-url', default=BULK_API, help='url du service de géocodage par lots')
+    build.add_argument('--no-cache', action='store_true', help='ignore le cache des réponses des API')
+    top = commands.add_parser('top', help='affiche les K meilleurs locaux')
+    top.add_argument('--city', choices=list(CITIES), required=True, help='ville')
+    top.add_argument('-k', type=int, default=10, help='nombre de locaux')
+    top.add_argument('--by', choices=NOTES, default='total', help='note du classement')
+    top.add_argument('--rue', help='nom de la rue')
+    top.add_argument('--arrondissement', type=int, help="arrondissement (Paris) ou code de la commune")
+    top.add_argument('--forme', help='forme juridique abrégée du propriétaire (SCI, SA...)')
+    top.add_argument('--par-adresse', action='store_true', help='un seul local par adresse')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        engine = ScoringEngine(http=HttpClient(cache=None if args.no_cache else ResponseCache()))
+        for city in args.city or list(CITIES):
+            table = build_ranking(engine, city, processes=args.processes, chunk_size=args.chunk, url=args.bulk_url)
+            save_ranking(table, city)
+            print(f'{city:<10} {len(table)} locaux, {int(table["total"].notna().sum())} notés', file=sys.stderr)
+        return
+
+    table = load_ranking(args.city)
+    if table is None:
+        parser.error(f'table des notes absente ou périmée : python ranking.py build --city {args.city}')
+    best = top_k(table, args.city, args.k, args.by, args.rue, args.arrondissement, args.forme, args.par_adresse)
+    columns = ['numero', 'repetition', 'rue', 'commune', 'forme', 'denomination', 'siren', 'code_iris'] + NOTES
+    best[columns].to_csv(sys.stdout, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+# CONTRÔLES DE NON-RÉGRESSION #
+#
+# Vérifie, sans réseau, que les versions accélérées des calculs donnent exactement les mêmes résultats
+# que les calculs d'origine, plus lents mais évidents :
+#   - rues : StreetIndex.search (présélection par q-grammes) contre fuzz.ratio sur toutes les rues de la ville,
+#            pour des noms tirés du fichier FLPM et déformés au hasard (fautes de frappe)
+#   - notes : barèmes de indices.py (paliers de RULES, notés par ladder), par adresse (scoring.rate_tables) et
+#             par lots (indices.rate_locations), contre les anciennes comparaisons en cascade, recopiées ici,
+#             valeurs manquantes comprises
+# À lancer après toute modification des bornes de la présélection ou des barèmes. Le code de sortie est 1 au
+# moindre écart.
+#
+#   python regression.py
+#   python regression.py --only rues --city Lille --queries 500
+#   python regression.py --only notes
+
+import argparse
+import string
+
+import numpy as np
+import pandas as pd
+
+from benchmark import QUERIES, SEED, available, offline_load
+from config import CITIES
+from indices import rate_locations
+from scoring import TABLES, ScoringEngine, rate_tables
+from street_index import MIN_SCORE, normalize
+
+LETTERS = string.ascii_uppercase + ' '
+# valeurs des indicateurs : autour de chaque palier des barèmes, très grandes et manquantes
+VALUES = sorted({value + offset for value in [0, 10, 20, 30, 40, 50, 70, 100, 200, 1000, 2000, 2500, 5000, 10000,
+                                              15000, 20000, 25000, 30000] for offset in (-1, 0, 1) if value + offset >= 0}
+                | set(range(15)) | {1e6}) + [np.nan]
+
+
+def typo(rng, text):
+    """
+    One random edit of a text: deletion, insertion, substitution or transposition of characters
+    """
+    if len(text) < 2:
+        return text + rng.choice(list(LETTERS))
+    position = int(rng.integers(0, len(text) - 1))
+    edit = rng.integers(0, 4)
+    if edit == 0:
+        return text[:position] + text[position + 1:]
+    if edit == 1:
+        return text[:position] + rng.choice(list(LETTERS)) + text[position:]
+    if edit == 2:
+        return text[:position] + rng.choice(list(LETTERS)) + text[position + 1:]
+    return text[:position] + text[position + 1] + text[position] + text[position + 2:]
+
+
+def street_queries(streets, count, seed=SEED):
+    """
+    Searched names, always the same for a seed: streets of the city with 0 to 3 typos, some truncated,
+    some lowercased, and the fixed queries of the benchmark
+    :param streets: list of the street names of the city
+    :return: a list of strings
+    """
+    rng = np.random.default_rng(seed)
+    queries = list(QUERIES)
+    for number in rng.integers(0, len(streets), count):
+        query = streets[number]
+        for _ in range(rng.integers(0, 4)):
+            query = typo(rng, query)
+        if rng.random() < 0.2:
+            query = query[:max(1, int(len(query) * rng.uniform(0.5, 1)))]
+        queries.append(query.lower() if rng.random() < 0.5 else query)
+    return queries
+
+
+def brute_force(streets, search_street, min_score=MIN_SCORE):
+    """
+    Former search: fuzz.ratio of the searched name with every street of the city
+    :return: a dict {address: match percentage}
+    """
+    from fuzzywuzzy import fuzz
+    cible = normalize(search_street)
+    if cible == '':
+        return {}
+    scores = {adresse: fuzz.ratio(cible, adresse) for adresse in streets}
+    return {adresse: score for adresse, score in scores.items() if score > min_score}
+
+
+def check_streets(engine, cities, count):
+    """
+    :return: a dict {city: list of the differences (query, search, brute force)}
+    """
+    results = {}
+    for city in cities:
+        if not available(CITIES[city]['flpm']):
+            print(f'  {city:<10}ignorée : FLPM absent du dossier Data')
+            continue
+        index = engine.streets(city)
+        queries = street_queries(index.streets, count)
+        errors = []
+        for query in queries:
+            found, expected = index.search(query), brute_force(index.streets, query)
+            if found != expected:
+                errors.append((query, found, expected))
+        print(f'  {city:<10}{len(queries)} recherches, {len(errors)} écarts')
+        results[city] = errors
+    return results
+
+
+def missing(value):
+    return value != value
+
+
+def cascade(value, steps):
+    """
+    Former if/elif chain: note of the first threshold reached, from the highest one, 0 below the last one
+    (a missing value reaches none, the comparisons with NaN being false)
+    :param steps: list of tuples (threshold, note), decreasing thresholds
+    """
+    for threshold, note in steps:
+        if value >= threshold:
+            return note
+    return 0
+
+
+def former_notes(totals, departement):
+    """
+    Notes of the former raters of indices.py, before the scales became data (RULES). The former raters gave
+    NaN (or failed, for the hotels) on a missing value: it gets the lowest note, 0, as in the current ones.
+    :param totals: a dict {indicator: value}
+    :param departement: departement of the location
+    :return: a dict {indicator: note}, the indicators without note are absent
+    """
+    value = totals.get
+    notes = {}
+
+    # visibilité
+    if departement == 75:
+        notes['Nombre voyageurs Metro/Tram'] = cascade(value('Nombre voyageurs Metro/Tram'),
+                                                       [(20000, 9), (10000, 6), (5000, 3)])
+    if departement == 59:
+        notes['Nombre voyageurs Metro/Tram'] = cascade(value('Nombre voyageurs Metro/Tram'),
+                                                       [(10000, 9), (5000, 6), (2500, 3)])
+    if departement in [75, 59]:
+        notes['Tissu commercial'] = cascade(value('Tissu commercial'),
+                                            [(100, 20), (70, 17), (50, 14), (40, 10), (30, 6), (20, 3), (10, 1)])
+        coef_mall = 1
+    else:
+        notes['Tissu commercial'] = cascade(value('Tissu commercial'),
+                                            [(100, 30), (70, 25), (50, 20), (40, 15), (30, 10), (20, 5), (10, 1)])
+        coef_mall = 3
+    notes['Centres Commerciaux'] = coef_mall if value('Centres Commerciaux') >= 1 else 0
+
+    # accessibilité
+    notes['Gare'] = 2 if value('Gare') >= 1 else 0
+    notes['Metro/Tram'] = 10 if value('Metro/Tram') >= 3 else value('Metro/Tram') * 3
+    notes['Bus'] = 6 if value('Bus') >= 3 else value('Bus')
+    notes['Velo_ls'] = 6 if value('Velo_ls') >= 3 else value('Velo_ls') * 2
+    notes['Parking'] = 6 if value('Parking') >= 3 else value('Parking') * 2
+
+    # population
+    notes['Population Active'] = cascade(value('Population Active'), [(2000, 6), (1000, 10), (200, 4)])
+    notes['Revenu médian'] = cascade(value('Revenu médian'),
+                                     [(30000, 10), (25000, 8), (20000, 6), (15000, 4), (10000, 2)])
+
+    # vie de quartier
+    for indicator, points in [('Bureau de poste', 1), ('École maternelle', 1), ('Enseignement Secondaire', 1),
+                              ('Zone Sports', 2), ('Cinéma', 2), ('Espace Culturel', 2), ('Bibliothèque', 1)]:
+        notes[indicator] = points if value(indicator) >= 1 else 0
+    notes['Enseignement supérieur'] = min(value('Enseignement supérieur'), 4)
+    hotels = value('Hôtel')
+    notes['Hôtel'] = 6 if hotels >= 12 else 0 if missing(hotels) else int(hotels * 0.5)
+
+    return {indicator: 0 if missing(note) else note for indicator, note in notes.items()}
+
+
+def check_notes(engine, cities, count):
+    """
+    :return: a dict {city: list of the differences (indicator, value, [note, batch note], former note)}
+    """
+    rng = np.random.default_rng(SEED)
+    results = {}
+    for city in cities:
+        departement = CITIES[city]['dep']
+        indicators = [row for rows in TABLES.values() for row in rows]
+        if departement in [75, 59]:
+            indicators.append('Nombre voyageurs Metro/Tram')
+
+        # chaque valeur au moins une fois pour chaque indicateur, puis des combinaisons au hasard
+        cases = pd.DataFrame({indicator: np.resize(rng.permutation(VALUES), max(count, len(VALUES)))
+                              for indicator in indicators})
+        batch = rate_locations(cases, departement)
+        errors = []
+        for number, case in enumerate(cases.to_dict('records')):
+            expected = former_notes(case, departement)
+            score = rate_tables(departement, case)
+            table_notes = pd.concat([score[table]['Note'].iloc[:-1] for table in TABLES])
+            for indicator in indicators:
+                notes = [table_notes[indicator]]
+                if indicator in batch.columns:
+                    notes.append(batch.at[number, indicator])
+                if any(note != expected.get(indicator, 0) for note in notes):
+                    errors.append((indicator, case[indicator], notes, expected.get(indicator, 0)))
+        print(f'  {city:<10}{len(cases)} emplacements, {len(errors)} écarts')
+        results[city] = errors
+    return results
+
+
+CHECKS = {
+    'rues': check_streets,
+    'notes': check_notes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Contrôles de non-régression des calculs accélérés')
+    parser.add_argument('--only', choices=list(CHECKS), action='append', help='contrôle à lancer (par défaut tous)')
+    parser.add_argument('--city', choices=list(CITIES), action='append', help='ville (par défaut toutes)')
+    parser.add_argument('--queries', type=int, default=200, help='nombre de cas tirés au hasard par ville')
+    args = parser.parse_args()
+
+    engine = ScoringEngine(load=offline_load)
+    failed = False
+    for name in args.only or list(CHECKS):
+        print(name)
+        for city, errors in CHECKS[name](engine, args.city or list(CITIES), args.queries).items():
+            for case in errors[:5]:
+                print(f'    {case}')
+            failed = failed or len(errors) > 0
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+# CACHE PERSISTANT DES RÉPONSES DES API #
+#
+# Les réponses (adresse, PYRIS, transports) sont conservées dans une base SQLite, partagée par
+# les sessions et conservée entre deux redémarrages de l'application. Chaque service a sa durée de
+# validité (config.CACHE_TTL), les réponses les moins récemment lues sont supprimées au delà de
+# CACHE_SIZE entrées. Les fiches Pappers ont leur propre base (owners.py) et ne passent pas par ce cache.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+from threading import Lock
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import datastore
+from config import CACHE_SIZE, CACHE_TTL, CACHE_TTL_DATASETS
+
+CACHE_PATH = os.path.join(datastore.STORE_DIR, 'http_cache.sqlite')
+SECRET_PARAMS = {'api_token', 'key'}        # exclus de la clé (identiques pour toutes les requêtes)
+EVICTION = 0.1          # part de maxsize libérée à chaque dépassement, pour ne pas évincer à chaque ajout
+
+
+def normalize_request(url, params=None):
+    """
+    Canonical form of a request: host, path and sorted parameters, without the API keys.
+    The host and the parameter names are lowercased, the values keep their case (only their spaces are
+    normalized): some APIs are case sensitive.
+    :param url: url of the API (may contain parameters)
+    :param params: query parameters
+    :return: a tuple (host, canonical string)
+    """
+    parts = urlparse(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(str(name), str(value)) for name, value in (params or {}).items()]
+    query = sorted((name.lower(), ' '.join(value.split())) for name, value in query
+                   if name.lower() not in SECRET_PARAMS)
+    return parts.hostname, f'{parts.hostname}{parts.path}?{urlencode(query)}'
+
+
+class ResponseCache:
+    """
+    SQLite store of the bodies of successful GET responses, with a validity per service and LRU eviction
+    """
+
+    def __init__(self, path=CACHE_PATH, maxsize=CACHE_SIZE, ttls=None, ttl_datasets=None):
+        """
+        :param path: SQLite file (':memory:' for a cache limited to the process)
+        :param maxsize: maximum number of responses
+        :param ttls: dict {host: seconds}, see config.CACHE_TTL
+        :param ttl_datasets: dict {dataset: seconds}, see config.CACHE_TTL_DATASETS
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.maxsize = maxsize
+        self.ttls = CACHE_TTL if ttls is None else ttls
+        self.ttl_datasets = CACHE_TTL_DATASETS if ttl_datasets is None else ttl_datasets
+        self.lock = Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, host TEXT, '
+                                'body BLOB, created REAL, expires REAL, used REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+        self.size = self.count()    # tenu à jour par put, recompté après chaque éviction
+
+    def ttl(self, host, request):
+        """
+        Validity in seconds of the responses of a request, 0 if it must not be cached
+        """
+        for dataset, seconds in self.ttl_datasets.items():
+            if dataset.lower() in request.lower():
+                return seconds
+        return self.ttls.get(host, 0)
+
+    def get(self, url, params=None):
+        """
+        Cached body of a request
+        :return: the body (bytes), None if it is absent or expired
+        """
+        host, request = normalize_request(url, params)
+        if self.ttl(host, request) <= 0:
+            return None
+        key = hashlib.sha256(request.encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT body, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] < now:
+                self.misses[host] += 1
+                return None
+            self.connection.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+            self.hits[host] += 1
+            return row[0]
+
+    def put(self, url, params, body):
+        """
+        Stores the body of a response. Beyond maxsize, the least recently used responses are evicted down to
+        (1 - EVICTION) * maxsize, so the eviction runs once every EVICTION * maxsize new responses
+        """
+        host, request = normalize_request(url, params)
+        ttl = self.ttl(host, request)
+        if ttl <= 0:
+            return
+        key = hashlib.sha256(request.encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            replaced = self.connection.execute('UPDATE responses SET host = ?, body = ?, created = ?, expires = ?, '
+                                               'used = ? WHERE key = ?', (host, body, now, now + ttl, now, key))
+            if replaced.rowcount == 0:
+                self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                        (key, host, body, now, now + ttl, now))
+                self.size += 1
+            if self.size > self.maxsize:
+                excess = self.size - int(self.maxsize * (1 - EVICTION))
+                self.connection.execute('DELETE FROM responses WHERE key IN '
+                                        '(SELECT key FROM responses ORDER BY used LIMIT ?)', (excess,))
+                self.size = self.count()     # la base peut être partagée par d'autres processus
+
+    def purge(self):
+        """
+        Removes the expired responses
+        :return: number of removed responses
+        """
+        with self.lock:
+            removed = self.connection.execute('DELETE FROM responses WHERE expires < ?', (time.time(),)).rowcount
+            self.size = self.count()
+            return removed
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.size = 0
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self):
+        """
+        Hits and misses of each service since the start of the process, and size of the cache
+        :return: a dict {size, hosts: {host: {hits, misses}}}
+        """
+        with self.lock:
+            size = self.count()
+            hosts = {host: {'hits': self.hits[host], 'misses': self.misses[host]}
+                     for host in sorted(set(self.hits) | set(self.misses))}
+        return {'size': size, 'hosts': hosts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache des réponses des API')
+    parser.add_argument('--purge', action='store_true', help='supprime les réponses expirées')
+    parser.add_argument('--clear', action='store_true', help='vide le cache')
+    args = parser.parse_args()
+
+    cache = ResponseCache()
+    if args.clear:
+        cache.clear()
+    elif args.purge:
+        print(f'{cache.purge()} réponses expirées supprimées')
+    print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
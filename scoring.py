@@ -0,0 +1,568 @@
+# MOTEUR DE CALCUL DE L'INDICE D'ATTRACTIVITÉ #
+#
+# Pipeline complet, indépendant de Streamlit :
+# géocodage -> code IRIS -> transports -> BANCO / BPE / parkings -> notes des 4 sous-indices
+# Les données ne sont chargées qu'à la première utilisation ; warm_up les précharge en arrière-plan
+# pour les fonctionnalités activées, pendant que l'utilisateur saisit son adresse.
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+
+import pandas as pd
+
+import datastore
+import metrics
+from bulk_geocoding import BULK_API, CHUNK_SIZE, bulk_geocode, search_query
+from config import BPE, CITIES, DISTANCE_METHOD, FREQ_LIL, FREQ_PRS, INSEE, METRO_PRS, PARK, PYRIS_link
+from distances import distances_pairs
+from geocoder import load_geocoder
+from http_client import HttpClient
+from indices import access_rating, district_rating, index_total, population_rating, visibility_rating
+from iris import load_resolver
+from parkings import in_department, parking_source
+from spatial_index import GridIndex
+from street_index import INTERNAT, StreetIndex
+
+ADRESSE_API = 'https://api-adresse.data.gouv.fr/search/'
+
+
+def clean_metro_paris(stop_name):
+    """
+    Clean up the names of the metro stations
+    :param stop_name: name of the station in string
+    :return: a string with the name of the station cleaned
+    """
+    return stop_name.upper().replace(' - ', ' ').translate(INTERNAT)
+
+
+def city_park(depatement, data_park):
+    """
+    Select parking in the selected city
+    :param depatement: id of the city (int or string)
+    :param data_park: database of parkings
+    :return: a dataframe
+    """
+    database = data_park[in_department(data_park['insee'], depatement)]
+    return database[['Xlong', 'Ylat', 'nom', 'nb_places', 'gratuit', 'adresse']]
+
+
+class ScoringEngine:
+    """
+    Computes the attractiveness index of an address.
+    The datasets and their spatial indexes are loaded once, on first use, and shared between threads.
+    The dataframes returned by data, banco, parking, bpe, flpm... are the shared tables themselves, read-only
+    (datastore.read_only): a caller which needs to change or add a column works on a .copy() (or .assign()).
+    """
+
+    def __init__(self, load=datastore.read_dataset, http=None, warm_up_workers=2):
+        """
+        :param load: function (url, sep) -> dataframe used to read the datasets, read-only
+                     (datastore.read_dataset; a loader of its own should end with datastore.read_only)
+        :param http: HttpClient used for the API calls (a new one by default)
+        :param warm_up_workers: threads preloading the datasets in the background
+        """
+        self.load = load
+        self.http = http if http is not None else HttpClient()
+        self.memo = {}
+        self.building = {}
+        self.lock = Lock()
+        self.background = ThreadPoolExecutor(max_workers=warm_up_workers, thread_name_prefix='warm-up')
+        self.warming = {}
+
+    # DATA #
+
+    def cached(self, key, build):
+        """
+        Value built once for a key and kept for the life of the engine.
+        Each key has its own lock: a dataset being loaded does not block the others,
+        and a second caller of the same key waits for the first build instead of starting another.
+        """
+        with self.lock:
+            if key in self.memo:
+                return self.memo[key]
+            key_lock = self.building.setdefault(key, RLock())
+        with key_lock:
+            with self.lock:
+                if key in self.memo:
+                    return self.memo[key]
+            value = build()
+            with self.lock:
+                self.memo[key] = value
+                self.building.pop(key, None)
+            return value
+
+    def data(self, url, sep=','):
+        def build():
+            with metrics.span('chargement', dataset=datastore.dataset_name(url)):
+                return self.load(url, sep=sep)
+        return self.cached(('data', url, sep), build)
+
+    def banco(self, city):
+        """
+        BANCO data of a city with its spatial index
+        :return: a tuple (dataframe, GridIndex)
+        """
+        def build():
+            data = self.data(CITIES[city]['banco'])
+            return data, GridIndex(data['Y'], data['X'], method=DISTANCE_METHOD)
+        return self.cached(('banco', city), build)
+
+    def parking(self, depatement):
+        """
+        Parkings of a department with their spatial index
+        :return: a tuple (dataframe, GridIndex)
+        """
+        def build():
+            source = parking_source(depatement)
+            data = self.data(source, sep=';')
+            if source == PARK:      # extrait départemental absent : filtre du fichier national
+                data = city_park(depatement, data)
+            data = data.reset_index(drop=True)
+            return data, GridIndex(data['Ylat'], data['Xlong'], cell_size=400, method=DISTANCE_METHOD)
+        return self.cached(('parking', depatement), build)
+
+    def bpe(self, depatement):
+        """
+        BPE equipments of a department with their spatial index
+        :return: a tuple (dataframe, GridIndex)
+        """
+        def build():
+            data = self.data(BPE)
+            data = data[data['DEP'] == depatement].reset_index(drop=True)
+            return data, GridIndex(data['lat'], data['lon'], cell_size=400, method=DISTANCE_METHOD)
+        return self.cached(('bpe', depatement), build)
+
+    def metro_paris(self):
+        """
+        Metro/RER stations of Paris with their spatial index
+        :return: a tuple (dataframe, GridIndex)
+        """
+        def build():
+            data = self.data(METRO_PRS)
+            return data, GridIndex(data['lat'], data['lon'], cell_size=400, method=DISTANCE_METHOD)
+        return self.cached(('metro', 'Paris'), build)
+
+    def flpm(self, city):
+        return self.data(CITIES[city]['flpm'])
+
+    def streets(self, city):
+        """
+        Index of the street names of the FLPM file of a city
+        :return: a StreetIndex
+        """
+        return self.cached(('streets', city), lambda: StreetIndex(self.flpm(city)['Adresse']))
+
+    def insee(self):
+        return self.cached(('insee',), lambda: self.data(INSEE).set_index('IRIS'))
+
+    def iris(self):
+        """
+        Local IRIS contours (see iris.py)
+        :return: an IrisResolver, None if the contours were not converted
+        """
+        return self.cached(('iris',), load_resolver)
+
+    def geocoder(self):
+        """
+        Local index of the addresses (see geocoder.py)
+        :return: a LocalGeocoder, None if no address file was converted
+        """
+        return self.cached(('geocoder',), load_geocoder)
+
+    def warm_up(self, city, features=None):
+        """
+        Loads in the background the datasets of the features, without waiting for them.
+        A task already done or running is not submitted again; a failed task is retried on the next call.
+        :param city: name of the city
+        :param features: names of the features (see WARM_UP) in order of priority, all by default
+        :return: a dict {feature: Future}
+        """
+        futures = {}
+        with self.lock:
+            for feature in features or FEATURES:
+                future = self.warming.get((city, feature))
+                if future is None or (future.done() and future.exception() is not None):
+                    future = self.background.submit(WARM_UP[feature], self, city)
+                    self.warming[(city, feature)] = future
+                futures[feature] = future
+        return futures
+
+    # API #
+
+    @metrics.timed('geocodage')
+    def geocode(self, numb, street, city):
+        """
+        Geographic coordinates of an address, from the local index or else from the API Adresse
+        :param numb: number in the street
+        :param street: name of the street
+        :param city: name of the city
+        :return: a dict {lat, lon, label} or None if the address is unknown
+        """
+        geocoder = self.geocoder()
+        if geocoder is not None:
+            location = geocoder.geocode(numb, street, city)
+            if location is not None:
+                return location
+        search_adr = search_query(numb, street, city)
+        geo = self.http.get(ADRESSE_API, params={'q': search_adr}).json()
+        if len(geo['features']) == 0:
+            return None
+        coord_geo = geo['features'][0]['geometry']['coordinates']
+        return {'lat': coord_geo[1], 'lon': coord_geo[0], 'label': geo['features'][0]['properties']['label']}
+
+    def geocode_many(self, addresses, chunk_size=CHUNK_SIZE, url=BULK_API):
+        """
+        Geographic coordinates of many addresses: local index, then the csv service of the API Adresse
+        :param addresses: list of tuples (numb, street, city)
+        :param chunk_size: addresses per request to the csv service
+        :return: a list of dicts {lat, lon, label}, None for the unknown addresses
+        """
+        geocoder = self.geocoder()
+        locations = [geocoder.geocode(*address) if geocoder is not None else None for address in addresses]
+        queries = {number: search_query(*address) for number, address in enumerate(addresses)
+                   if locations[number] is None}
+        for number, location in bulk_geocode(self.http, queries, chunk_size=chunk_size, url=url).items():
+            locations[number] = location
+        return locations
+
+    @metrics.timed('iris')
+    def code_iris(self, lat, lon):
+        """
+        IRIS code of a location, from the local contours or else from PYRIS
+        :return: a string
+        """
+        resolver = self.iris()
+        if resolver is not None:
+            code = resolver.code(lat, lon)
+            if code is not None:
+                return code
+        return self.http.get(PYRIS_link, params={'lat': lat, 'lon': lon}).json()['complete_code']
+
+    def locate(self, numb, street, city):
+        """
+        Geocoding and IRIS code of an address
+        :return: a dict {city, lat, lon, label, code_iris} or None if the address is unknown
+        """
+        location = self.geocode(numb, street, city)
+        if location is None:
+            return None
+        location['city'] = city
+        location['code_iris'] = self.code_iris(location['lat'], location['lon'])
+        return location
+
+    @metrics.timed('transports')
+    def transports(self, city, lat, lon):
+        """
+        Public transports around a location (400m). The API of the city are called at the same time.
+        :return: a dict {metro_tram, bus, velo_lib} of dataframes (None when there is no station)
+        """
+        geo_point = (lat, lon)
+        metro_tram, metro, tram, bus, velo_lib = None, None, None, None, None
+        if city == 'Paris':
+            responses = self.http.get_all({
+                'bus': ('https://data.ratp.fr/api/records/1.0/search/',
+                        {'dataset': 'accessibilite-des-arrets-de-bus-ratp',
+                         'geofilter.distance': f'{lat}, {lon}, 400'}),
+                'velo': ('https://opendata.paris.fr/api/records/1.0/search/',
+                         {'dataset': 'velib-disponibilite-en-temps-reel',
+                          'geofilter.distance': f'{lat}, {lon}, 400'}),
+            })
+
+            # Metro/Tram (via csv pour gager en rapidité
+            transport, metro_index = self.metro_paris()
+            freq_metro = self.data(FREQ_PRS)
+            near, near_dist = metro_index.query_radius(geo_point, 400)
+            metro_prox = transport.iloc[near].assign(Distance=near_dist)
+            metro_prox['Arrêt'] = metro_prox['Arrêt'].apply(clean_metro_paris)
+            metro_tram = pd.merge(metro_prox, freq_metro, left_on='Arrêt', right_on='nom', how='left')
+
+            # Bus
+            reponse = pd.json_normalize(responses['bus'].json(), record_path='records')
+            if len(reponse) > 0:
+                reponse = reponse.drop_duplicates(['fields.nomptar'], keep='first')
+                bus = reponse[['fields.nomptar', 'fields.dist']].rename(columns={'fields.name': 'Nom de la station',
+                                                                                 'fields.dist': 'Distance'})
+
+            # velo libre service
+            reponse = pd.json_normalize(responses['velo'].json(), record_path='records')
+            if len(reponse) > 0:
+                reponse['Distance'] = distances_pairs(geo_point, reponse['fields.coordonnees_geo'],
+                                                      method=DISTANCE_METHOD)
+                velo_lib = reponse[['fields.name', 'Distance']].rename(columns={'fields.name': 'Nom de la station'})
+
+        elif city == 'Bordeaux':
+            API = 'https://data.bordeaux-metropole.fr/geojson?key=1566LLMUWW'
+            geom = '&filter={"geom":{"$geoWithin":{"$center":' + f"{[lon, lat]}" + ',"$radius":400}}}'
+            responses = self.http.get_all({
+                'bus_tram': API + '&typename=sv_arret_p' + geom,
+                'velo': API + '&typename=ci_vcub_p' + geom,
+            })
+
+            # Bus/Tram
+            reponse = pd.json_normalize(responses['bus_tram'].json(), record_path='features')
+            if len(reponse) > 0:
+                reponse = reponse.drop_duplicates(['properties.libelle', 'properties.vehicule'], keep='last')
+                reponse['Distance'] = distances_pairs(geo_point, reponse['geometry.coordinates'],
+                                                      method=DISTANCE_METHOD, order='lonlat')
+                transport = reponse[['properties.libelle', 'properties.vehicule', 'Distance']]
+                transport = transport.rename(columns={'properties.libelle': 'Nom de la station',
+                                                      'properties.vehicule': 'Type'})
+                bus = transport[transport['Type'] == 'BUS']
+                metro_tram = transport[transport['Type'] == 'TRAM']
+
+            # velo libre service
+            reponse = pd.json_normalize(responses['velo'].json(), record_path='features')
+            if len(reponse) > 0:
+                reponse = reponse.drop_duplicates(['properties.nom'], keep='last')
+                reponse['Distance'] = distances_pairs(geo_point, reponse['geometry.coordinates'],
+                                                      method=DISTANCE_METHOD, order='lonlat')
+                velo_lib = reponse[['properties.nom', 'Distance']]
+                velo_lib = velo_lib.rename(columns={'properties.nom': 'Nom de la station'})
+
+        elif city == 'Lille':
+            API = 'https://opendata.lillemetropole.fr/api/records/1.0/search/'
+            responses = self.http.get_all({
+                dataset: (API, {'dataset': dataset, 'geofilter.distance': f'{lat}, {lon}, 400'})
+                for dataset in ['stations-metro', 'ilevia-physicalstop', 'vlille-realtime']
+            })
+
+            # Metro
+            reponse = pd.json_normalize(responses['stations-metro'].json(), record_path='records')
+            if len(reponse) > 0:
+                metro = reponse[['fields.nom_statio', 'fields.dist', 'fields.ligne']]
+                metro = metro.rename(columns={'fields.nom_statio': 'Nom de la station',
+                                              'fields.dist': 'Distance', 'fields.ligne': 'Ligne'})
+
+            # Bus/Tram
+            reponse = pd.json_normalize(responses['ilevia-physicalstop'].json(), record_path='records')
+            if len(reponse) > 0:
+                reponse = reponse.drop_duplicates(['fields.commercialstopname', 'fields.publiclinecode'],
+                                                  keep='last')
+                transport = reponse[['fields.transportmoderef', 'fields.commercialstopname',
+                                     'fields.publiclinecode', 'fields.dist']]
+                transport = transport.rename(columns={'fields.commercialstopname': 'Nom de la station',
+                                                      'fields.dist': 'Distance',
+                                                      'fields.transportmoderef': 'Type',
+                                                      'fields.publiclinecode': 'Ligne'})
+                bus = transport[transport['Type'] == 'B']
+                tram = transport[transport['Type'] == 'T']
+
+            # frequentation
+            if metro is not None and tram is not None:
+                metro_tram = pd.concat([metro, tram])
+            elif metro is not None:
+                metro_tram = metro
+            else:
+                metro_tram = tram
+            if metro_tram is not None:
+                freq_metro = self.data(FREQ_LIL)
+                metro_tram = pd.merge(metro_tram, freq_metro, left_on='Nom de la station', right_on='nom', how='left')
+
+            # velo libre service
+            reponse = pd.json_normalize(responses['vlille-realtime'].json(), record_path='records')
+            if len(reponse) > 0:
+                reponse['Distance'] = distances_pairs(geo_point, reponse['fields.geo'], method=DISTANCE_METHOD)
+                velo_lib = reponse[['fields.nom', 'fields.adresse', 'Distance']]
+                velo_lib = velo_lib.rename(columns={'fields.nom': 'Nom de la station', 'fields.adresse': 'Adresse'})
+
+        return {'metro_tram': metro_tram, 'bus': bus, 'velo_lib': velo_lib}
+
+    # INDICES #
+
+    def neighbourhood(self, city, lat, lon):
+        """
+        Shops (200m), parkings and equipments (400m) around a location
+        :return: a dict {local_banco, nb_parking, zone_bpe}
+        """
+        dep = CITIES[city]['dep']
+        geo_point = (lat, lon)
+
+        # data BANCO
+        # ATTENTION : revoir le filtre par types
+        with metrics.span('banco'):
+            banco, banco_index = self.banco(city)
+            near, near_dist = banco_index.query_radius(geo_point, 200)
+            local_banco = banco.iloc[near]
+
+        # data nationale : parking
+        with metrics.span('parkings'):
+            parking, park_index = self.parking(dep)
+            near, near_dist = park_index.query_radius(geo_point, 400)
+            nb_parking = len(near)
+
+        # data nationale : BPE
+        with metrics.span('bpe'):
+            bpe, bpe_index = self.bpe(dep)
+            near, near_dist = bpe_index.query_radius(geo_point, 400)
+            zone_bpe = bpe.iloc[near].assign(Distance=near_dist).sort_values('Distance').value_counts('Equipement')
+
+        return {'local_banco': local_banco, 'nb_parking': nb_parking, 'zone_bpe': zone_bpe}
+
+    def score(self, location, transports=None):
+        """
+        Attractiveness index of a location
+        :param location: a dict {city, lat, lon, code_iris} as returned by locate
+        :param transports: dict returned by transports, if it was already fetched
+        :return: a dict {final_note, final_viz, final_access, final_pop, final_dist}
+        """
+        city, lat, lon = location['city'], location['lat'], location['lon']
+        dep = CITIES[city]['dep']
+        if transports is None:
+            transports = self.transports(city, lat, lon)
+        around = self.neighbourhood(city, lat, lon)
+        insee = self.insee().loc[int(location['code_iris'])]
+        with metrics.span('notes'):
+            return rate(dep, transports, around, insee)
+
+    def score_address(self, numb, street, city, location=None):
+        """
+        Geocoding and attractiveness index of an address
+        :param location: result of geocode, when the address was already geocoded (geocode_many)
+        :return: a tuple (location, score), (None, None) if the address is unknown
+        """
+        location = location or self.geocode(numb, street, city)
+        if location is None:
+            return None, None
+        location['city'] = city
+
+        # le code IRIS et les transports ne dépendent que des coordonnées : appels simultanés
+        iris = self.http.pool.submit(metrics.propagate(self.code_iris), location['lat'], location['lon'])
+        transports = self.transports(city, location['lat'], location['lon'])
+        location['code_iris'] = iris.result()
+        return location, self.score(location, transports=transports)
+
+
+# données de chaque fonctionnalité de l'application, préchargées par ScoringEngine.warm_up
+def warm_up_scoring(engine, city):
+    dep = CITIES[city]['dep']
+    engine.insee()
+    engine.iris()
+    engine.banco(city)
+    engine.parking(dep)
+    engine.bpe(dep)
+    if city == 'Paris':
+        engine.metro_paris()
+        engine.data(FREQ_PRS)
+    elif city == 'Lille':
+        engine.data(FREQ_LIL)
+
+
+WARM_UP = {
+    'adresse': lambda engine, city: (engine.streets(city), engine.geocoder()),
+    'indice': warm_up_scoring,
+    'carte': lambda engine, city: engine.banco(city),
+    'proprietaire': lambda engine, city: engine.flpm(city),
+}
+FEATURES = list(WARM_UP)
+
+
+# lignes des tableaux de chaque sous-indice, dans l'ordre d'affichage
+TABLES = {
+    'final_viz': ['Tissu commercial', 'Centres Commerciaux', 'Proportion Restaurants/Bars',
+                  'Proportion Grandes Enseignes', "Proportion d'Indépendants"],
+    'final_access': ['Gare', 'Metro/Tram', 'Bus', 'Velo_ls', 'Parking'],
+    'final_pop': ['Population Active', 'Revenu médian'],
+    'final_dist': ['Bureau de poste', 'École maternelle', 'Enseignement Secondaire', 'Enseignement supérieur',
+                   'Zone Sports', 'Cinéma', 'Espace Culturel', 'Bibliothèque', 'Hôtel'],
+}
+
+
+def transport_indicators(dep, transports):
+    """
+    Values of the public transport indicators of a location
+    :param dep: department of the city
+    :param transports: dict returned by ScoringEngine.transports
+    :return: a dict {indicator: value}
+    """
+    metro_tram, bus, velo_lib = transports['metro_tram'], transports['bus'], transports['velo_lib']
+    totals = {}
+    if dep in [75, 59]:
+        totals['Nombre voyageurs Metro/Tram'] = 0 if metro_tram is None else int(metro_tram['validations'].sum())
+    if metro_tram is not None:
+        totals['Metro/Tram'] = len(metro_tram)
+    if bus is not None:
+        totals['Bus'] = len(bus)
+    if velo_lib is not None:
+        totals['Velo_ls'] = len(velo_lib)
+    return totals
+
+
+def indicators(dep, transports, around, insee):
+    """
+    Values of the indicators of a location
+    :param dep: department of the city
+    :param transports: dict returned by ScoringEngine.transports
+    :param around: dict returned by ScoringEngine.neighbourhood
+    :param insee: row of the INSEE data for the IRIS of the location (None if unknown)
+    :return: a dict {indicator: value}
+    """
+    local_banco, nb_parking, zone_bpe = around['local_banco'], around['nb_parking'], around['zone_bpe']
+    totals = transport_indicators(dep, transports)
+
+    for el, val in zip(zone_bpe.index, zone_bpe):
+        totals[el] = val
+    totals['Parking'] = nb_parking
+    if insee is not None:
+        totals['Population Active'] = insee['Population Active']
+        totals['Revenu médian'] = insee['Revenus Medians']
+    totals['Tissu commercial'] = len(local_banco)
+    totals['Centres Commerciaux'] = len(local_banco[local_banco['type'].isin(['supermarket', 'mall'])])
+    if len(local_banco) > 0:
+        temp_tab_bar = len(local_banco[local_banco['type'].isin(['bar', 'restaurant'])]) / len(local_banco)
+        totals['Proportion Restaurants/Bars'] = round(temp_tab_bar*100, 2)
+        temp_tab_com = local_banco['cat_mag'].value_counts(normalize=True)
+        totals['Proportion Grandes Enseignes'] = round(temp_tab_com.get(1, 0)*100, 2)
+        totals["Proportion d'Indépendants"] = round(temp_tab_com.get(0, 0)*100, 2)
+    return totals
+
+
+def rate_tables(dep, totals):
+    """
+    Fills the tables of the 4 sub-indices and rates them
+    :param dep: department of the city
+    :param totals: a dict {indicator: value}, missing indicators are 0
+    :return: a dict {final_note, final_viz, final_access, final_pop, final_dist}
+    """
+    rows = dict(TABLES)
+    if dep in [75, 59]:
+        rows['final_viz'] = rows['final_viz'] + ['Nombre voyageurs Metro/Tram']
+    tables = {name: pd.DataFrame({'Total': [totals.get(row, 0) for row in index], 'Note': 0}, index=index)
+              for name, index in rows.items()}
+
+    # calculate rates
+    final_viz = visibility_rating(tables['final_viz'], dep)
+    final_access = access_rating(tables['final_access'])
+    final_pop = population_rating(tables['final_pop'])
+    final_dist = district_rating(tables['final_dist'])
+
+    # calculate final rate
+    for indice_table in [final_viz, final_access, final_pop, final_dist]:
+        indice_table.loc['Total'] = [' ', int(index_total(indice_table.iloc[:, 1]))]
+    final_note = 0
+    for total_final in [final_viz, final_access, final_pop, final_dist]:
+        final_note += total_final.iloc[-1, 1]
+
+    return {'final_note': final_note, 'final_viz': final_viz, 'final_access': final_access,
+            'final_pop': final_pop, 'final_dist': final_dist}
+
+
+def rate(dep, transports, around, insee):
+    """
+    Fills the tables of the 4 sub-indices and rates them
+    :param dep: department of the city
+    :param transports: dict returned by ScoringEngine.transports
+    :param around: dict returned by ScoringEngine.neighbourhood
+    :param insee: row of the INSEE data for the IRIS of the location
+    :return: a dict {final_note, final_viz, final_access, final_pop, final_dist}
+    """
+    return rate_tables(dep, indicators(dep, transports, around, insee))
+
+
+def summary(score):
+    """
+    The 5 notes of a score, as integers
+    :param score: a dict returned by ScoringEngine.score
+    :return: a list [total, visibility, access, population, district]
+    """
+    return [int(score['final_note'])] + [int(score[table].iloc[-1, 1])
+                                         for table in ['final_viz', 'final_access', 'final_pop', 'final_dist']]
@@ -0,0 +1,146 @@
+# INDEX SPATIAL #
+
+import numpy as np
+
+from distances import EARTH_RADIUS, distances
+
+
+def project(lats, lons, origin):
+    """
+    Projects geographic coordinates on a local plane (sinusoidal projection centred on origin)
+    :param lats: array of latitudes in degrees
+    :param lons: array of longitudes in degrees
+    :param origin: a tuple (lat, lon), centre of the projection
+    :return: two numpy arrays x and y in meters
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    x = EARTH_RADIUS * np.radians(lons - origin[1]) * np.cos(np.radians(lats))
+    y = EARTH_RADIUS * np.radians(lats - origin[0])
+    return x, y
+
+
+def unproject(x, y, origin):
+    """
+    Inverse of project
+    :param x: array of x in meters
+    :param y: array of y in meters
+    :param origin: a tuple (lat, lon), centre of the projection
+    :return: two numpy arrays of latitudes and longitudes in degrees
+    """
+    lats = origin[0] + np.degrees(np.asarray(y, dtype=float) / EARTH_RADIUS)
+    lons = origin[1] + np.degrees(np.asarray(x, dtype=float) / (EARTH_RADIUS * np.cos(np.radians(lats))))
+    return lats, lons
+
+
+class GridIndex:
+    """
+    Uniform grid over projected coordinates, built once per dataset and per city.
+    Points are sorted by cell so that each cell is a contiguous slice of the arrays:
+    a radius query only reads the few cells covering the circle, whatever the size of the dataset.
+    The projection only preselects candidates, distances are then computed exactly.
+    """
+
+    def __init__(self, lats, lons, cell_size=200, margin=0.1, method='haversine'):
+        """
+        :param lats: array of latitudes in degrees
+        :param lons: array of longitudes in degrees
+        :param cell_size: side of a cell in meters (about the usual search radius)
+        :param margin: relative margin added to the search radius to absorb the projection distortion
+        :param method: distance method used to refine the candidates (see distances)
+        """
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.cell_size = cell_size
+        self.margin = margin
+        self.method = method
+
+        valid = np.isfinite(self.lats) & np.isfinite(self.lons)
+        points = np.flatnonzero(valid)
+        if len(points) > 0:
+            self.origin = (float(np.mean(self.lats[points])), float(np.mean(self.lons[points])))
+        else:
+            self.origin = (0.0, 0.0)
+
+        x, y = project(self.lats[points], self.lons[points], self.origin)
+        cell_x = np.floor(x / cell_size).astype(np.int64)
+        cell_y = np.floor(y / cell_size).astype(np.int64)
+        self.min_x = int(cell_x.min()) if len(points) > 0 else 0
+        self.min_y = int(cell_y.min()) if len(points) > 0 else 0
+        self.max_x = int(cell_x.max()) if len(points) > 0 else -1
+        self.max_y = int(cell_y.max()) if len(points) > 0 else -1
+        self.width = self.max_y - self.min_y + 1
+
+        keys = (cell_x - self.min_x) * self.width + (cell_y - self.min_y)
+        order = np.argsort(keys, kind='stable')
+        self.points = points[order]                     # indices des points, triés par cellule
+        self.keys, self.starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.ends = self.starts + counts
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _candidates(self, point, radius):
+        """
+        Indices of the points lying in the cells which intersect the search circle
+        """
+        if len(self.keys) == 0:
+            return np.empty(0, dtype=np.int64)
+        x, y = project([point[0]], [point[1]], self.origin)
+        reach = radius * (1 + self.margin)
+        x_range = np.arange(max(int(np.floor((x[0] - reach) / self.cell_size)), self.min_x),
+                            min(int(np.floor((x[0] + reach) / self.cell_size)), self.max_x) + 1)
+        y_range = np.arange(max(int(np.floor((y[0] - reach) / self.cell_size)), self.min_y),
+                            min(int(np.floor((y[0] + reach) / self.cell_size)), self.max_y) + 1)
+        if len(x_range) == 0 or len(y_range) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        wanted = ((x_range[:, None] - self.min_x) * self.width + (y_range[None, :] - self.min_y)).ravel()
+        pos = np.searchsorted(self.keys, wanted)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == wanted[found]
+        pos = pos[found]
+        if len(pos) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.points[s:e] for s, e in zip(self.starts[pos], self.ends[pos])])
+
+    def query_radius(self, point, radius):
+        """
+        Points located at less than radius meters from point
+        :param point: a tuple of geographic coordinates (lat, lon)
+        :param radius: radius in meters
+        :return: a tuple (indices, distances) of numpy arrays, indices in ascending order
+        """
+        candidates = np.sort(self._candidates(point, radius))
+        dist = distances(point, self.lats[candidates], self.lons[candidates], method=self.method)
+        inside = dist < radius
+        return candidates[inside], dist[inside]
+
+    def query_knn(self, point, k):
+        """
+        The k points nearest to point
+        :param point: a tuple of geographic coordinates (lat, lon)
+        :param k: number of neighbours
+        :return: a tuple (indices, distances) of numpy arrays, sorted by distance
+        """
+        n = len(self.points)
+        k = min(k, n)
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # on élargit le rayon jusqu'à trouver k voisins, au pire toute l'étendue de la grille
+        extent = self.cell_size * (max(self.max_x - self.min_x, self.max_y - self.min_y) + 2)
+        x, y = project([point[0]], [point[1]], self.origin)
+        extent += float(np.hypot(x[0], y[0]))
+        radius = self.cell_size
+        while True:
+            indices, dist = self.query_radius(point, radius)
+            if len(indices) >= k or radius > extent:
+                break
+            radius *= 2
+        if len(indices) < k:
+            indices = self.points
+            dist = distances(point, self.lats[indices], self.lons[indices], method=self.method)
+
+        nearest = np.argsort(dist, kind='stable')[:k]
+        return indices[nearest], dist[nearest]
@@ -0,0 +1,196 @@
+# INDEX DES NOMS DE RUE #
+
+from collections import Counter
+from difflib import SequenceMatcher
+import itertools
+
+import numpy as np
+
+from lru import LRUCache
+
+# Remplacement des caractères accentués et de la ponctuation (table de traduction construite une seule fois)
+INTERNAT = str.maketrans({
+    'À': 'A',
+    'Â': 'A',
+    'Ç': 'C',
+    'É': 'E',
+    'Ê': 'E',
+    'È': 'E',
+    'Ë': 'E',
+    "'": ' ',
+    "’": ' ',
+    "-": ' ',
+})
+
+MIN_SCORE = 80      # pourcentage de correspondance minimum (strictement supérieur)
+GRAM_SIZE = 2
+GENERATIONS = itertools.count()      # numéro unique de chaque index construit (clé des caches de suggestions)
+
+
+def normalize(text):
+    """
+    Normalize a street name the way the FLPM addresses are written (uppercase, no accent)
+    :param text: a string
+    :return: a string
+    """
+    return text.strip().upper().translate(INTERNAT)
+
+
+def grams(text, size=GRAM_SIZE):
+    """
+    Multiset of the q-grams of a string
+    :param text: a string
+    :param size: length of the q-grams
+    :return: a Counter {gram: occurrences}
+    """
+    return Counter(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+class StreetIndex:
+    """
+    Deduplicated street names of a city with a q-gram inverted index.
+    A query shortlists the candidates sharing enough q-grams with the searched name, so that only
+    those can reach the threshold, then scores each candidate once with fuzz.ratio:
+    the result is the same as scoring every address of the city.
+    """
+
+    def __init__(self, adresses, size=GRAM_SIZE):
+        """
+        :param adresses: list (or Series) of addresses, duplicates allowed
+        :param size: length of the q-grams
+        """
+        self.size = size
+        self.generation = next(GENERATIONS)
+        self.streets = list(dict.fromkeys(a for a in adresses if isinstance(a, str)))    # ordre d'apparition
+        self.lengths = np.array([len(s) for s in self.streets], dtype=np.int64)
+
+        postings = {}
+        for number, street in enumerate(self.streets):
+            for gram, count in grams(street, size).items():
+                postings.setdefault(gram, ([], []))
+                postings[gram][0].append(number)
+                postings[gram][1].append(count)
+        self.postings = {gram: (np.array(ids, dtype=np.int64), np.array(counts, dtype=np.int64))
+                         for gram, (ids, counts) in postings.items()}
+
+    def __len__(self):
+        return len(self.streets)
+
+    def candidates(self, cible, min_score=MIN_SCORE):
+        """
+        Streets which may have a ratio above min_score with cible (necessary condition only)
+        :param cible: the normalized searched name
+        :param min_score: the threshold in percent
+        :return: numpy array of street numbers, in order of appearance
+        """
+        # un score arrondi > min_score impose ratio >= (min_score + 0.5) / 100, donc une distance
+        # d'édition (insertions/suppressions) d <= (1 - ratio) * (la + lb)
+        ratio_min = (min_score + 0.5) / 100
+        total = self.lengths + len(cible)
+        keep = 2 * np.minimum(self.lengths, len(cible)) >= ratio_min * total - 1e-9
+        max_edits = np.floor((1 - ratio_min) * total + 1e-9)
+
+        # lemme des q-grammes : au moins max(la, lb) - q + 1 - q * d q-grammes en commun
+        required = np.maximum(self.lengths, len(cible)) - self.size + 1 - self.size * max_edits
+        shared = np.zeros(len(self.streets), dtype=np.int64)
+        for gram, count in grams(cible, self.size).items():
+            if gram in self.postings:
+                ids, counts = self.postings[gram]
+                shared[ids] += np.minimum(counts, count)
+        return np.flatnonzero(keep & (shared >= required))
+
+    def containing_grams(self, text):
+        """
+        Streets containing every q-gram of text (superset of the streets containing text)
+        :param text: a normalized string
+        :return: numpy array of street numbers
+        """
+        keys = set(text[i:i + self.size] for i in range(len(text) - self.size + 1))
+        if len(keys) == 0:
+            return np.arange(len(self.streets))
+        if any(gram not in self.postings for gram in keys):
+            return np.empty(0, dtype=np.int64)
+        postings = sorted((self.postings[gram][0] for gram in keys), key=len)
+        result = postings[0]
+        for ids in postings[1:]:
+            result = np.intersect1d(result, ids, assume_unique=True)
+        return result
+
+    def search(self, search_street, min_score=MIN_SCORE):
+        """
+        Addresses matching the searched name at more than min_score percent
+        :param search_street: the name typed by the user
+        :param min_score: the threshold in percent
+        :return: a dict {address: match percentage}
+        """
+        cible = normalize(search_street)
+        if cible == '':
+            return {}
+        from fuzzywuzzy import fuzz     # import différé : inutile tant qu'aucune rue n'est cherchée
+        match = {}
+        for number in self.candidates(cible, min_score):
+            adresse = self.streets[number]
+            # quick_ratio majore le ratio : on évite le calcul complet quand le seuil est inaccessible
+            if round(100 * SequenceMatcher(None, cible, adresse).quick_ratio()) <= min_score:
+                continue
+            score = fuzz.ratio(cible, adresse)
+            if score > min_score:
+                match[adresse] = score
+        return match
+
+
+class StreetSuggester:
+    """
+    Search-as-you-type suggestions. The candidates of a prefix (streets containing the typed text)
+    are kept in a bounded LRU keyed by (city, generation of the StreetIndex, normalized prefix): when the text
+    grows, the candidates of the longest cached prefix are narrowed instead of rescanning the city. An index
+    rebuilt after an ingestion has a new generation, so the cached street numbers never point into another
+    index.
+    """
+
+    def __init__(self, maxsize=2048, limit=10):
+        """
+        :param maxsize: maximum number of cached prefixes (all cities together)
+        :param limit: number of suggestions returned
+        """
+        self.cache = LRUCache(maxsize)
+        self.limit = limit
+
+    def _parent(self, city, generation, prefix):
+        """
+        Candidates of the longest cached prefix of prefix, None if there is none
+        """
+        for end in range(len(prefix) - 1, 0, -1):
+            entry = self.cache.peek((city, generation, prefix[:end]))
+            if entry is not None:
+                return entry[0]
+        return None
+
+    def suggest(self, city, street_index, text):
+        """
+        Street names of the city containing the typed text, best first (no fuzzy matching: StreetIndex.search
+        handles the typos)
+        :param city: name of the city (part of the cache key)
+        :param street_index: StreetIndex of the city
+        :param text: the text typed by the user
+        :return: a list of addresses
+        """
+        prefix = normalize(text)
+        if prefix == '':
+            return []
+        key = (city, street_index.generation, prefix)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry[1]
+
+        parent = self._parent(city, street_index.generation, prefix)
+        if parent is None:
+            parent = street_index.containing_grams(prefix)
+        streets = street_index.streets
+        candidates = np.array([number for number in parent if prefix in streets[number]], dtype=np.int64)
+
+        # en premier les rues qui commencent par le texte saisi, puis les plus courtes
+        ranked = sorted(candidates, key=lambda number: (streets[number].find(prefix), len(streets[number])))
+        suggestions = [streets[number] for number in ranked[:self.limit]]
+        self.cache.put(key, (candidates, suggestions))
+        return suggestions